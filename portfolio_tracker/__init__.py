@@ -15,11 +15,30 @@ def create_app(test_config=None):
         SECRET_KEY='dev',
         DATABASE=os.path.join(app.instance_path, 'db.sqlite'),
         DEBUG=True,
-        CACHE_TYPE="SimpleCache",
+        CACHE_TYPE="portfolio_tracker.lrucache.LRUCache",
+        CACHE_MAX_BYTES=64*1024*1024, # least recently used results are evicted over this size
         CACHE_DEFAULT_TIMEOUT=300,
         SESSION_TYPE = "cachelib",
         SESSION_CACHELIB = FileSystemCache(cache_dir='sessions', threshold=500),
-        SESSION_SERIALIZATION_FORMAT = 'json'
+        SESSION_SERIALIZATION_FORMAT = 'json',
+        USER_DATA_DIR=os.path.join(app.instance_path, 'user_data'), # per-user transactions, positions and info
+        USER_DATA_THRESHOLD=1500,
+        INFO_FETCH_WORKERS=8,
+        INFO_TTL={ # seconds each field group of symbol information is cached for
+            'quote': 900,
+            'splits': 86400,
+            'classification': 604800
+        },
+        MARKET_DATA_PROVIDER='yfinance', # yfinance, fixtures or synthetic
+        MARKET_DATA_FIXTURES=os.path.join(app.instance_path, 'fixtures'),
+        LOT_SNAPSHOT_INTERVAL=100, # transactions of a symbol between lot snapshots
+        UPLOAD_CHUNK_SIZE=10000, # rows of an uploaded file read at a time
+        SQLITE_PRAGMAS={ # applied to each database connection
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -32000, # KiB
+            'mmap_size': 268435456
+        }
     )
     cache.init_app(app)
     sess.init_app(app)
@@ -40,6 +59,12 @@ def create_app(test_config=None):
     from . import db
     db.init_app(app)
 
+    from . import providers
+    providers.init_app(app)
+
+    from . import userdata
+    userdata.init_app(app)
+
     from . import tests
     tests.init_app(app)
 
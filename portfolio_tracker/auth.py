@@ -3,6 +3,7 @@ import re
 from werkzeug.security import check_password_hash, generate_password_hash
 from portfolio_tracker.db import get_db
 from portfolio_tracker.controller import controller
+from portfolio_tracker.userdata import discard_user_data, new_data_key
 from datetime import datetime
 from flask import (
     Blueprint, flash, g, redirect, render_template, request, session, url_for, Response, jsonify
@@ -69,6 +70,8 @@ def login():
             error = 'Incorrect password.'
 
         if error is None:
+            if g.user:
+                discard_user_data()
             session.clear()
             session['user_id'] = user['id']
             db.execute('''UPDATE user SET last_login = ? WHERE id = ?''', (datetime.today().strftime('%Y-%m-%d'), user['id']))
@@ -76,15 +79,10 @@ def login():
 
             # Update data
             load_logged_in_user()
-            session['info'] = None
-            session['positions'] = {}
-            session['transactions_df'] = None
-            session['history'] = None
+            new_data_key()
             controller.update_info([])
             controller.update_history([], None)
-            controller.update_transactions(None,None)
-            controller.update_positions()
-            controller.update_database(None,None)
+            controller.load_user_data()
             return redirect(url_for('index'))
 
         flash(error,'error')
@@ -112,6 +110,8 @@ def load_logged_in_user():
 def logout():
     '''Clear session to log out
     '''
+    if g.user:
+        discard_user_data()
     session.clear()
     return redirect(url_for('main.index'))
 
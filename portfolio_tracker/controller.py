@@ -1,9 +1,22 @@
-import yfinance as yf
+import hashlib
+import json
+import sqlite3
 import numpy as np
 import pandas as pd
-from portfolio_tracker.db import get_db
-from flask import g, Response, session
+from portfolio_tracker.db import content_hashes, get_db, insert_transactions
+from portfolio_tracker.prices import INDEXES, get_missing_ranges, save_history
+from portfolio_tracker.providers import get_provider
+from portfolio_tracker.lots import (
+    Position, apply_transaction, decode_positions, load_lots, load_snapshot,
+    replay, replay_position, save_lots, save_positions, save_snapshots
+)
+from portfolio_tracker.metadata import FIELD_GROUPS, build_info, get_stale, load_info, save_info
+from portfolio_tracker.userdata import (
+    bump_version, get_info, get_lot_splits, get_positions, get_transactions, set_info, set_lot_splits, set_positions, set_transactions
+)
+from flask import current_app, g, Response
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 class Controller:
     '''Class to manage getting and updating data and validating transactions
@@ -15,6 +28,7 @@ class Controller:
         '''Validate transaction and route updates
         '''
         self.errors = []
+        self.pending = None
 
         # Enter or Edit
         if action in ['enter','edit']:
@@ -49,8 +63,13 @@ class Controller:
             self.update_history(tran['symbol'], tran['tran_date'])
 
             # update transactions and positions, if no errors, update database
-            self.update_transactions(action, tran)
-            self.update_positions()
+            if action == 'enter' and self._is_latest(tran):
+                # latest trade for the symbol, no need to replay history
+                self.apply_latest_transaction(tran)
+            else:
+                changes = self._changed_since(action, tran)
+                self.update_transactions(action, tran)
+                self.update_positions(changes)
             if len(self.errors)>0:
                 return self.errors
             self.update_database(action, tran)
@@ -58,8 +77,9 @@ class Controller:
         # Delete
         elif action == 'delete':
             # update transactions and positions, if no errors, update database
+            changes = self._changed_since(action, tran)
             self.update_transactions(action, tran)
-            self.update_positions()
+            self.update_positions(changes)
             if len(self.errors) > 0:
                 return self.errors
             self.update_database(action, tran)
@@ -84,15 +104,34 @@ class Controller:
             self.update_history(symbols, min(tran['tran_date']))
 
             # update transactions and positions, if no errors, update database
+            changes = self._changed_since(action, tran)
             self.update_transactions(action, tran)
-            self.update_positions()
+            self.update_positions(changes)
             if len(self.errors)>0:
                 return self.errors
             self.update_database(action, tran)
         return self.errors
 
-    def update_info(self, symbols):
-        ''' Check and update information for symbols
+    def _changed_since(self, action, tran):
+        '''Get the earliest transaction date changed for each symbol affected by an action
+        '''
+        if action in ['enter','delete']:
+            return {tran['symbol']: pd.Timestamp(tran['tran_date'])}
+        elif action == 'edit':
+            db = get_db()
+            old = db.execute('''SELECT symbol, tran_date FROM transactions WHERE id = ? ''', (tran['id'],)).fetchone()
+            changes = {tran['symbol']: pd.Timestamp(tran['tran_date'])}
+            if old:
+                changes[old['symbol']] = min(changes.get(old['symbol'], pd.Timestamp(old['tran_date'])), pd.Timestamp(old['tran_date']))
+            return changes
+        elif action == 'upload':
+            dates = pd.to_datetime(tran['tran_date']).groupby(tran['symbol']).min()
+            return dates.to_dict()
+        return None
+
+    def update_info(self, symbols, refresh=()):
+        ''' Check and update information for symbols from the shared metadata cache.
+        Field groups that are missing, older than their TTL or listed in refresh are fetched
         '''
         self.errors = []
 
@@ -102,104 +141,161 @@ class Controller:
             symbols = [p[0] for p in positions]
         if type(symbols) == str: # Single symbol provided
             symbols = [symbols]
-        info = session.get('info')
-        updates = []
+        symbols = list(dict.fromkeys(symbols))
+        info = get_info()
         
         # info doesn't exist
         if not info:
-            for symbol in symbols:
-                updates.append(symbol)
             info = {}
 
-        # new symbols
-        for symbol in symbols:
-            if symbol not in info.keys():
-                updates.append(symbol)
+        # missing or stale field groups
+        cached = load_info(symbols)
+        stale = get_stale(cached, symbols, current_app.config['INFO_TTL'], refresh)
 
         # update
-        if len(updates) > 0:
-            for symbol in symbols:
-                try:
-                    symbol_info = {}
-                    ticker = yf.Ticker(symbol)
-                    symbol_info['price'] = round(ticker.fast_info.last_price,2)
-                    symbol_info['previous_close'] = round(ticker.fast_info.previous_close,2)
-                    splits = ticker.splits
-                    splits.index = splits.index.strftime('%Y-%m-%d')
-                    symbol_info['splits'] = splits.to_dict()
-                    s, a = self._get_sectors_assets(ticker)
-                    symbol_info['sectors'] = s
-                    symbol_info['assets'] = a
-                    info[symbol] = symbol_info
-                except:
-                    self.errors.append(f"symbol {symbol} not found")
-
-        session['info'] = info
+        if len(stale) > 0:
+            fetched, failures = self._fetch_info(stale)
+            save_info(fetched)
+            for symbol, groups in fetched.items():
+                for group, data in groups.items():
+                    cached.setdefault(symbol, {})[group] = (data, datetime.now())
+
+            # keep stale data if a refresh fails, only missing data is an error
+            for symbol in stale.keys():
+                missing = [group for group in FIELD_GROUPS if group not in cached.get(symbol, {})]
+                if len(missing) > 0:
+                    reasons = [f'{group}: {type(failures[symbol][group]).__name__}: {failures[symbol][group]}' for group in missing if group in failures.get(symbol, {})]
+                    self.errors.append(f"symbol {symbol} not found" + (f" ({'; '.join(reasons)})" if reasons else ''))
+
+        info.update(build_info(cached))
+        set_info(info)
+
+    def _fetch_info(self, stale):
+        '''Fetch stale field groups (symbol -> field groups) for symbols in parallel. Returns the
+        fetched data (symbol -> field group -> data) and the errors (symbol -> field group -> exception)
+        '''
+        provider = get_provider()
+        symbols = list(stale.keys())
+        workers = min(current_app.config['INFO_FETCH_WORKERS'], len(symbols))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda symbol: self._fetch_symbol_info(provider, symbol, stale[symbol]), symbols))
+        fetched = {symbol: result[0] for symbol, result in zip(symbols, results)}
+        failures = {symbol: result[1] for symbol, result in zip(symbols, results) if len(result[1]) > 0}
+        return fetched, failures
+
+    def _fetch_symbol_info(self, provider, symbol, groups):
+        '''Fetch field groups for a symbol. Groups that fail to fetch are left out of the data and
+        their exceptions returned instead, so one failure does not stop the other fetches
+        '''
+        fetched = {}
+        failures = {}
+        for group in groups:
+            try:
+                if group == 'quote':
+                    quote = provider.get_quote(symbol)
+                    fetched[group] = {
+                        'price': round(quote['price'],2),
+                        'previous_close': round(quote['previous_close'],2)
+                    }
+                elif group == 'splits':
+                    fetched[group] = {'splits': provider.get_splits(symbol)}
+                elif group == 'classification':
+                    s, a = provider.get_classification(symbol)
+                    fetched[group] = {'sectors': s, 'assets': a}
+            except Exception as e:
+                failures[group] = e
+        return fetched, failures
 
     def update_history(self, new_symbols, dt):
-        '''Check and update price histories for symbols
+        '''Check and update the shared price history store for symbols
         '''
         if not hasattr(self, 'errors'):
             self.errors = []
 
         if type(new_symbols) == str: # single symbol provided
             new_symbols = [new_symbols]
-        elif len(new_symbols) == 0: # no symbols provided
-            db = get_db()
-            positions = db.execute('''SELECT DISTINCT symbol FROM transactions WHERE user_id = ? ''', (g.user['id'],)).fetchall()
-            new_symbols = [p[0] for p in positions]
-        new_symbols.extend(['^GSPC','^DJI','^IXIC','^TNX']) # add indexes for comparisons
-        
-        if not dt: # no minimum date provided
-            db = get_db()
-            dt = db.execute('''SELECT MIN(tran_date) FROM transactions WHERE user_id = ? ''', (g.user['id'],)).fetchone()[0]
-        dt = pd.Timestamp(dt)
 
-        try:
-            history = pd.DataFrame(session.get('history'))
-            history.index = pd.to_datetime(history.index)
-        except:
-            history = None
-        update = False
-
-        # history exists
-        if isinstance(history, pd.DataFrame) and len(history) > 0: 
-            symbols = list(history.columns)
-            min_date = min(history.index)
-            new_symbols = [s for s in new_symbols if s not in symbols]
-            if len(new_symbols) > 0: # new symbols
-                update = True
-                symbols.extend(new_symbols)
-            if dt < min_date:
-                update = True
-                min_date = dt
-
-        # history doesn't exist
-        else: 
-            update = True
-            min_date = dt
-            symbols = []
-            for symbol in new_symbols:
-                symbols.append(symbol)
-        
-        # update
-        if update:
+        # every symbol needs history from the user's earliest transaction so the dates line up
+        db = get_db()
+        positions = db.execute('''SELECT DISTINCT symbol FROM transactions WHERE user_id = ? ''', (g.user['id'],)).fetchall()
+        symbols = list(dict.fromkeys([p[0] for p in positions] + list(new_symbols) + INDEXES)) # add indexes for comparisons
+        min_dt = db.execute('''SELECT MIN(tran_date) FROM transactions WHERE user_id = ? ''', (g.user['id'],)).fetchone()[0]
+        dates = [pd.Timestamp(d) for d in [dt, min_dt] if d]
+        if len(dates) == 0: # no transactions
+            return
+        dt = min(dates)
+        today = pd.Timestamp(datetime.today().date())
+
+        # fetch only the missing (symbols, date range) pieces and merge them into the store
+        missing = get_missing_ranges(symbols, dt, today)
+        for (start, end), updates in missing.items():
             try:
-                tickers=yf.Tickers(' '.join(symbols))
-                history = tickers.history(start=min_date.strftime('%Y-%m-%d'),period=None,interval='1d',auto_adjust=False)
-                history=history['Close'].dropna()
-                history.index = history.index.strftime('%Y-%m-%d')
-                session['history'] = history.to_dict()
+                history = get_provider().get_closes(updates, start.strftime('%Y-%m-%d'), self._history_end(end, today))
+                save_history(history, updates, start, end)
+                bump_version('price_version')
             except Exception as e:
-                self.errors.append('Failed to update history')
+                if 'Failed to update history' not in self.errors:
+                    self.errors.append('Failed to update history')
+
+    def _history_end(self, end, today):
+        '''Return the exclusive end date to request a price history range through,
+        or None to request through today
+        '''
+        if end >= today:
+            return None
+        return end.strftime('%Y-%m-%d')
+
+    def load_user_data(self):
+        '''Load the user's transactions and positions. The stored lots are used if the user's
+        transactions and splits have not changed since they were built, otherwise they are rebuilt
+        '''
+        self.update_transactions(None, None)
+        positions = load_lots(g.user['id'], self._lots_version())
+        if positions is None:
+            self.update_positions()
+            self.update_database(None, None)
+        else:
+            self._set_positions({symbol: position.to_bytes() for symbol, position in positions.items()})
+
+    def _split_digests(self, symbols):
+        '''Get a digest of the splits of each symbol
+        '''
+        info = get_info() or {}
+        return {symbol: hashlib.md5(json.dumps(info.get(symbol, {}).get('splits'), sort_keys=True).encode()).hexdigest() for symbol in symbols}
+
+    def _set_positions(self, positions):
+        '''Cache positions (symbol -> serialized lots) with the digest of the splits they were adjusted with
+        '''
+        set_positions(positions)
+        set_lot_splits(self._split_digests(positions.keys()))
+
+    def _stale_lots(self):
+        '''Get the symbols whose cached lots were adjusted with splits that have changed since,
+        for example when update_info refreshed them
+        '''
+        positions = get_positions() or {}
+        built = get_lot_splits() or {}
+        current = self._split_digests(positions.keys())
+        return [symbol for symbol in positions if built.get(symbol) != current[symbol]]
+
+    def _lots_version(self):
+        '''Get the version stamp of the user's transactions and the splits of their symbols
+        '''
+        db = get_db()
+        tran_version = db.execute('''SELECT tran_version FROM user WHERE id = ? ''', (g.user['id'],)).fetchone()[0]
+        symbols = db.execute('''SELECT DISTINCT symbol FROM transactions WHERE user_id = ? ''', (g.user['id'],)).fetchall()
+        info = get_info() or {}
+        splits = {p[0]: info.get(p[0], {}).get('splits') for p in symbols}
+        digest = hashlib.md5(json.dumps(splits, sort_keys=True).encode()).hexdigest()
+        return f'{tran_version}:{digest}'
 
     def update_transactions(self, action, tran):
         '''Handle splits and cache recomputed transactions
         '''
         # get transactions from database and ensure sell/fee transactions are negative
         db = get_db()
-        transactions_df = pd.read_sql_query('''SELECT tran_date, symbol, quantity, share_price, tran_type, id  FROM transactions WHERE user_id = ?''', db, params=(g.user['id'],))
-        transactions_df['quantity'] = transactions_df.apply(lambda x: abs(x['quantity']) if x['tran_type'] == 'BUY' else abs(x['quantity'])*-1, axis=1)
+        transactions_df = pd.read_sql_query('''SELECT tran_date, symbol, quantity, share_price, tran_type, id  FROM transactions WHERE user_id = ? ORDER BY id''', db, params=(g.user['id'],))
+        transactions_df['quantity'] = self._signed_quantity(transactions_df)
         
         if action == 'enter':
             # append new transaction row
@@ -208,7 +304,7 @@ class Controller:
         
         elif action == 'edit':
             # edit transaction row
-            transactions_df = pd.read_sql_query('''SELECT tran_date, symbol, quantity, share_price, tran_type, id  FROM transactions WHERE user_id = ?''', db, params=(g.user['id'],))
+            transactions_df = pd.read_sql_query('''SELECT tran_date, symbol, quantity, share_price, tran_type, id  FROM transactions WHERE user_id = ? ORDER BY id''', db, params=(g.user['id'],))
             ind = transactions_df[transactions_df['id']==tran['id']].index
             transactions_df.loc[ind, 'tran_date'] = tran['tran_date']
             transactions_df.loc[ind, 'symbol'] = tran['symbol']
@@ -232,169 +328,199 @@ class Controller:
 
         if len(transactions_df) > 0:
             # Handle splits
-            info = session.get('info')
-            splits = {}
-            for symbol in info.keys():
-                spl = pd.Series(info[symbol]['splits'])
-                spl.index = pd.to_datetime(spl.index)
-                splits[symbol] = spl
-            transactions_df['tran_date'] = pd.to_datetime(transactions_df['tran_date'])#.apply(pd.Timestamp)
-            transactions_df['quantity'] = transactions_df.apply(lambda x: abs(x['quantity']) if x['tran_type'] == 'BUY' else abs(x['quantity'])*-1, axis=1)
-            for ind, row in transactions_df.iterrows():
-                try:
-                    s=splits[row['symbol']]
-                    s.index=s.index.tz_localize(None)
-                    mult = np.cumprod(s[s.index > row['tran_date']]).values[-1]
-                    transactions_df.loc[ind,'quantity'] = row['quantity']*mult
-                    transactions_df.loc[ind,'share_price'] = row['share_price']/mult
-                except Exception as e:
-                    pass
+            transactions_df['tran_date'] = pd.to_datetime(transactions_df['tran_date'])
+            transactions_df['quantity'] = self._signed_quantity(transactions_df)
+            mult = self._split_multipliers(transactions_df, get_info())
+            transactions_df['quantity'] = transactions_df['quantity']*mult
+            transactions_df['share_price'] = transactions_df['share_price']/mult
 
             transactions_df['tran_date'] = transactions_df['tran_date'].dt.strftime('%Y-%m-%d')
-            session['transactions_df'] = transactions_df.to_dict()
+            set_transactions(transactions_df)
         else:
-            session['transactions_df'] = None
+            set_transactions(None)
+
 
+    def _signed_quantity(self, transactions_df):
+        '''Return quantities that are positive for buy and negative for sell/fee transactions
+        '''
+        quantity = transactions_df['quantity'].astype(float).abs()
+        return quantity.where(transactions_df['tran_type'] == 'BUY', -quantity)
 
-    def update_positions(self):
-        '''Update positions 
+    def _split_multipliers(self, transactions_df, info):
+        '''Return the split multiplier for each transaction: the product of the symbol's
+        splits after the transaction date, or 1 if there are none
+        '''
+        # cumulative multiplier of each split and all later splits for the symbol
+        splits = pd.DataFrame(
+            [(symbol, date, ratio) for symbol in transactions_df['symbol'].unique() if symbol in info
+                for date, ratio in info[symbol]['splits'].items()],
+            columns=['symbol','split_date','mult']
+        )
+        if len(splits) == 0:
+            return pd.Series(1.0, index=transactions_df.index)
+        splits['split_date'] = pd.to_datetime(splits['split_date']).astype('datetime64[ns]')
+        splits = splits.sort_values(['symbol','split_date'], ascending=False)
+        splits['mult'] = splits.groupby('symbol')['mult'].cumprod()
+
+        # first split after each transaction date
+        trans = transactions_df[['tran_date','symbol']].reset_index()
+        trans['tran_date'] = trans['tran_date'].astype('datetime64[ns]')
+        trans = pd.merge_asof(trans.sort_values('tran_date'), splits.sort_values('split_date'), left_on='tran_date', right_on='split_date',
+            by='symbol', direction='forward', allow_exact_matches=False)
+        return trans.set_index('index')['mult'].fillna(1.0).reindex(transactions_df.index)
+
+    def update_positions(self, changes=None):
+        '''Update positions. If changes maps symbols to the earliest date changed, only those
+        symbols are replayed, starting from their latest lot snapshot before that date. Symbols
+        whose cached lots were adjusted with splits that have changed are replayed from the start
         '''
         if not hasattr(self, 'errors'):
             self.errors = []
+        every = current_app.config['LOT_SNAPSHOT_INTERVAL']
 
-        transactions_df =pd.DataFrame(session.get('transactions_df'))
-        if isinstance(transactions_df,pd.DataFrame) and len(transactions_df) > 0:
+        transactions_df = get_transactions()
+        if transactions_df is not None and len(transactions_df) > 0:
             transactions_df['tran_date'] = pd.to_datetime(transactions_df['tran_date'])
+            positions = get_positions()
+
+            # replay changed symbols from snapshots, and all of the transactions of symbols whose splits changed
+            if changes is not None and positions is not None:
+                changes = dict(changes)
+                for symbol in self._stale_lots():
+                    changes[symbol] = None
+                positions = dict(positions)
+                pending = {'full': False, 'symbols': {}}
+                transactions_df = transactions_df.sort_values('tran_date', kind='stable')
+                for symbol, since in changes.items():
+                    rows = transactions_df[transactions_df['symbol'] == symbol]
+                    if len(rows) == 0: # no transactions left for symbol
+                        positions.pop(symbol, None)
+                        pending['symbols'][symbol] = (0, [])
+                        continue
+                    if since is None:
+                        seq, position = 0, Position()
+                    else:
+                        seq, position = load_snapshot(g.user['id'], symbol, since, self._split_digests([symbol])[symbol])
+                    position, symbol_snapshots, errors = replay_position(rows, position, seq, every)
+                    positions[symbol] = position.to_bytes()
+                    pending['symbols'][symbol] = (seq, symbol_snapshots)
+                    self.errors.extend(errors)
+
             # calculate positions
-            transactions_df = transactions_df.sort_values('tran_date')
-            positions = {}
-            for ind, row in transactions_df.iterrows():
-                symb = row['symbol']
-                if symb not in positions.keys():
-                    positions[symb] = {'ur':[],'r':[]}
-                # BUY
-                if row['tran_type'] == 'BUY':
-                    positions[symb]['ur'].append([row['quantity'],row['share_price']])
-                    
-                # SELL
-                elif row['tran_type'] == 'SELL':
-                    shares_to_sell = -row['quantity']
-                    for trade in positions[symb]['ur']:
-                        sold = min(shares_to_sell, trade[0])
-                        shares_to_sell -= sold
-                        trade[0] -= sold
-                        positions[symb]['r'].append([sold, sold*trade[1], sold*row['share_price']])
-                        if shares_to_sell == 0:
-                            break
-                    if shares_to_sell != 0:
-                        self.errors.append('Not enough shares to sell')
-
-                # FEE
-                elif row['tran_type'] == 'FEE':
-                    shares_to_sell = -row['quantity']
-                    for trade in positions[symb]['ur']:
-                        sold = min(shares_to_sell, trade[0])
-                        shares_to_sell -= sold
-                        trade[0] -= sold
-                        positions[symb]['r'].append([sold, sold*trade[1], 0])
-                        if shares_to_sell == 0:
-                            break
-                    if shares_to_sell != 0:
-                        self.errors.append('Not enough shares to sell')
+            else:
+                positions, symbol_snapshots, errors = replay(transactions_df, every)
+                positions = {symbol: position.to_bytes() for symbol, position in positions.items()}
+                pending = {'full': True, 'symbols': {symbol: (0, s) for symbol, s in symbol_snapshots.items()}}
+                self.errors.extend(errors)
 
             if len(self.errors) == 0:
-                session['positions'] = positions
+                self._set_positions(positions)
+                self.pending = pending
             else:
                 # unwind
-                session['transactions_df'] = None
                 self.update_transactions(None, None)
         else:
-            session['positions'] = {}
+            self._set_positions({})
+            self.pending = {'full': True, 'symbols': {}}
 
-    def update_database(self, action, tran):
-        ''' Update the database
+    def apply_latest_transaction(self, tran):
+        '''Apply a new transaction that is the latest for its symbol to the cached lots,
+        recomputing only that symbol's position
         '''
-        db = get_db()
-        if action == 'enter':
-            # Save transaction
-            db.execute(
-                        '''INSERT INTO transactions (user_id, tran_date, symbol, quantity, share_price, tran_type) 
-                        VALUES (?, ?, ?, ?, ?, ?)''',
-                        (g.user['id'], tran['tran_date'], tran['symbol'], tran['quantity'], tran['share_price'], tran['tran_type']),
-                )
-            db.commit()
-        
-        elif action == 'edit':
-            # update transaction
-            db.execute('''UPDATE transactions
-                SET tran_date = ?, symbol = ?, quantity = ?, share_price = ?, tran_type = ?
-                WHERE id = ? ''', (tran['tran_date'], tran['symbol'], tran['quantity'], tran['share_price'], tran['tran_type'], tran['id']))
-            db.commit()    
-        
-        elif action == 'delete':
-            # delete transaction
-            db.execute('''DELETE FROM transactions WHERE id = ? AND user_id = ? ''', (tran['id'], g.user['id']))
-            db.commit()
+        if not hasattr(self, 'errors'):
+            self.errors = []
 
-        elif action == 'delete-all':
-            # delete all transactions
-            db.execute('''DELETE FROM transactions WHERE user_id = ? ''', (g.user['id'],))
-            db.commit()
+        # split adjust the new transaction
+        row = pd.DataFrame({'tran_date': [pd.Timestamp(tran['tran_date'])], 'symbol': [tran['symbol']], 'quantity': [tran['quantity']],
+            'share_price': [tran['share_price']], 'tran_type': [tran['tran_type']]})
+        row['quantity'] = self._signed_quantity(row)
+        mult = self._split_multipliers(row, get_info())[0]
+        quantity = row['quantity'][0]*mult
+        share_price = row['share_price'][0]/mult
+
+        # apply to a copy of the symbol's lots so nothing changes if there are not enough shares
+        positions = dict(get_positions() or {})
+        position = Position.from_bytes(positions[tran['symbol']]) if tran['symbol'] in positions else Position()
+        if not apply_transaction(position, tran['tran_type'], quantity, share_price):
+            self.errors.append('Not enough shares to sell')
+            return
+        positions[tran['symbol']] = position.to_bytes()
+        self._set_positions(positions)
+
+        # snapshot the lots every LOT_SNAPSHOT_INTERVAL transactions of the symbol
+        db = get_db()
+        seq = db.execute('''SELECT COUNT(*) FROM transactions WHERE user_id = ? AND symbol = ? ''', (g.user['id'], tran['symbol'])).fetchone()[0]
+        snapshots = []
+        if (seq+1) % current_app.config['LOT_SNAPSHOT_INTERVAL'] == 0:
+            snapshots.append((seq+1, pd.Timestamp(tran['tran_date']).strftime('%Y-%m-%d'), position.to_bytes()))
+        self.pending = {'full': False, 'symbols': {tran['symbol']: (seq, snapshots)}}
+
+        # append to cached transactions
+        transactions = get_transactions()
+        ind = 0 if transactions is None or len(transactions) == 0 else transactions.index.max()+1
+        appended = pd.DataFrame({'tran_date': [tran['tran_date']], 'symbol': [tran['symbol']], 'quantity': [quantity],
+            'share_price': [share_price], 'tran_type': [tran['tran_type']], 'id': [np.nan]}, index=[ind])
+        set_transactions(appended if transactions is None else pd.concat([transactions, appended]))
+
+    def _is_latest(self, tran):
+        '''Check if a new transaction is on or after the last cached transaction for its symbol, and the
+        cached lots and transactions are adjusted with the current splits
+        '''
+        if get_positions() is None or len(self._stale_lots()) > 0:
+            return False
+        db = get_db()
+        latest = db.execute('''SELECT MAX(tran_date) FROM transactions WHERE user_id = ? AND symbol = ? ''', (g.user['id'], tran['symbol'])).fetchone()[0]
+        return latest is None or pd.Timestamp(latest) <= pd.Timestamp(tran['tran_date'])
 
-        elif action == 'upload':
-            # add multiple transactions
-            for ind, row in tran.iterrows():
-                db.execute(
-                            '''INSERT INTO transactions (user_id, tran_date, symbol, quantity, share_price, tran_type) 
-                            VALUES (?, ?, ?, ?, ?, ?)''',
-                            (g.user['id'], row['tran_date'], row['symbol'], row['quantity'], row['share_price'], row['tran_type']),
-                    )
-                db.commit()
-
-        # update positions
-        db.execute('''DELETE FROM positions WHERE user_id = ? ''', (g.user['id'],))
-        db.commit()
-        positions = session.get('positions')
-        for symb in positions.keys():
-            q = 0; cb = 0; rcb = 0; rv = 0
-            for ur in positions[symb]['ur']:
-                q += ur[0]
-                cb += ur[0]*ur[1]
-            for r in positions[symb]['r']:
-                rcb += r[1]
-                rv += r[2]
-            db.execute(
-                    '''INSERT INTO positions (user_id, symbol, quantity, cost_basis, realized_cost_basis, realized_value) 
-                    VALUES (?, ?, ?, ?, ?, ?)''',
-                    (g.user['id'], symb, q, cb, rcb, rv),
-            )
-            db.commit()        
-
-    def _get_sectors_assets(self, ticker):
-        '''Get sector and asset distributions for a ticker
+    def update_database(self, action, tran):
+        ''' Update the database in a single transaction. If any write fails everything is
+        rolled back and the user's data is reloaded from the database
         '''
-        info = ticker.info
-        ttype = info['typeDisp']
-
-        if ttype == 'Equity':
-            sector = info.get('sector')
-            sector = sector.lower().replace(' ','_')
-            sectors = {sector:1.0}
-            assets = {'stockPosition':1.0}
-
-        elif ttype in ['ETF','Fund']:
-            fundsdata = ticker.funds_data
-            sectors = fundsdata.sector_weightings
-            assets = fundsdata.asset_classes
-
-        elif ttype == 'Currency':
-            sectors = {}
-            assets = {'cashPosition':1.0}
-
-        elif ttype == 'Cryptocurrency':
-            sectors = {}
-            assets = {'crypto':1.0}
-            
-        return sectors, assets
+        db = get_db()
+        insert = '''INSERT INTO transactions (user_id, tran_date, symbol, quantity, share_price, tran_type, content_hash) 
+                    VALUES (?, ?, ?, ?, ?, ?, ?)'''
+        try:
+            with db:
+                if action == 'enter':
+                    # Save transaction
+                    db.execute(insert, (g.user['id'], tran['tran_date'], tran['symbol'], tran['quantity'], tran['share_price'], tran['tran_type'],
+                        content_hashes(g.user['id'], pd.DataFrame([tran]))[0]))
+
+                elif action == 'edit':
+                    # update transaction
+                    db.execute('''UPDATE transactions
+                        SET tran_date = ?, symbol = ?, quantity = ?, share_price = ?, tran_type = ?, content_hash = ?
+                        WHERE id = ? ''', (tran['tran_date'], tran['symbol'], tran['quantity'], tran['share_price'], tran['tran_type'],
+                        content_hashes(g.user['id'], pd.DataFrame([tran]))[0], tran['id']))
+
+                elif action == 'delete':
+                    # delete transaction
+                    db.execute('''DELETE FROM transactions WHERE id = ? AND user_id = ? ''', (tran['id'], g.user['id']))
+
+                elif action == 'delete-all':
+                    # delete all transactions
+                    db.execute('''DELETE FROM transactions WHERE user_id = ? ''', (g.user['id'],))
+
+                elif action == 'upload':
+                    # add multiple transactions
+                    insert_transactions(db, g.user['id'], tran)
+
+                # update stored lots and snapshots, stamped with the transactions and splits they were built from
+                if action is not None:
+                    db.execute('''UPDATE user SET tran_version = tran_version + 1 WHERE id = ? ''', (g.user['id'],))
+                pending = getattr(self, 'pending', None)
+                positions = decode_positions(get_positions())
+                save_snapshots(g.user['id'], pending, self._split_digests(pending['symbols'].keys()) if pending else {})
+                save_lots(g.user['id'], positions, pending, self._lots_version())
+
+                # update positions
+                save_positions(g.user['id'], positions)
+        except sqlite3.Error:
+            self.pending = None
+            self.errors.append('Failed to save transactions')
+            if action is not None:
+                self.load_user_data()
+            return
+        self.pending = None
 
 controller = Controller()
\ No newline at end of file
@@ -1,9 +1,14 @@
+import hashlib
 import sqlite3
+import time
 from datetime import datetime
 import click
+import pandas as pd
 from flask import current_app, g
 from werkzeug.security import check_password_hash, generate_password_hash
 
+migrated = set() # databases checked for migrations by this process
+
 def get_db():
     '''Get and return a database connection
     '''
@@ -13,10 +18,63 @@ def get_db():
             detect_types=sqlite3.PARSE_DECLTYPES
         )
         g.db.row_factory = sqlite3.Row
+        for pragma, value in current_app.config['SQLITE_PRAGMAS'].items():
+            g.db.execute(f'PRAGMA {pragma} = {value}')
+        if current_app.config['DATABASE'] not in migrated:
+            applied = upgrade_db(g.db)
+            if applied:
+                current_app.logger.info(f'Applied database migrations {applied}')
+            migrated.add(current_app.config['DATABASE'])
 
     return g.db
 
 
+def upgrade_db(db):
+    '''Apply any schema migrations an existing database is missing. Returns the versions applied
+    '''
+    from portfolio_tracker.migrations import migrate
+    if db.execute('''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user' ''').fetchone() is None:
+        return [] # not initialized yet
+    return migrate(db)
+
+
+def placeholders(values):
+    '''Return a comma separated list of SQL placeholders for values
+    '''
+    return ','.join('?'*len(values))
+
+
+def content_hashes(user_id, transactions):
+    '''Hash the content of each transaction in a frame (date, symbol, quantity, share price and type)
+    so that a transaction uploaded again can be recognized
+    '''
+    keys = (pd.to_datetime(transactions['tran_date']).dt.strftime('%Y-%m-%d') + '|' + transactions['symbol'].astype(str)
+        + '|' + transactions['quantity'].astype(float).abs().map(repr) + '|' + transactions['share_price'].astype(float).map(repr)
+        + '|' + transactions['tran_type'].astype(str).str.upper())
+    return [hashlib.sha1(f'{user_id}|{key}'.encode()).hexdigest() for key in keys]
+
+
+def insert_transactions(db, user_id, transactions):
+    '''Insert a frame of transactions for a user with their content hashes. The caller commits
+    '''
+    rows = transactions[['tran_date','symbol','quantity','share_price','tran_type']].itertuples(index=False, name=None)
+    db.executemany(
+        '''INSERT INTO transactions (user_id, tran_date, symbol, quantity, share_price, tran_type, content_hash) 
+        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+        ((user_id,) + row + (h,) for row, h in zip(rows, content_hashes(user_id, transactions)))
+    )
+
+
+def fill_content_hashes(db):
+    '''Set the content hash of transactions saved without one
+    '''
+    transactions = pd.read_sql_query('''SELECT id, user_id, tran_date, symbol, quantity, share_price, tran_type
+        FROM transactions WHERE content_hash IS NULL''', db)
+    for user_id, rows in transactions.groupby('user_id'):
+        db.executemany('''UPDATE transactions SET content_hash = ? WHERE id = ? ''',
+            zip(content_hashes(user_id, rows), rows['id'].tolist()))
+
+
 def close_db(e=None):
     '''Close database connection
     '''
@@ -28,10 +86,12 @@ def close_db(e=None):
 def init_db():
     '''Initialize the database tables
     '''
+    from portfolio_tracker.migrations import MIGRATIONS
     db = get_db()
 
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
+    db.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
 
     # Sample accounts and transactions
     db.execute(
@@ -66,6 +126,7 @@ def init_db():
         '''INSERT INTO transactions (user_id, tran_date, symbol, quantity, share_price, tran_type) VALUES (?, ?, ?, ?, ?, ?)''',
         (2,'2022-11-15','AAPL',100,150.04,'BUY')
     )
+    fill_content_hashes(db)
     db.commit()
 
 
@@ -77,10 +138,105 @@ def init_db_command():
     click.echo('Initialized the database.')
 
 
+@click.command('migrate-db')
+def migrate_db_command():
+    '''Upgrade an existing database to the current schema without clearing it
+    '''
+    db = get_db() # migrations are applied on first connection
+    version = db.execute('''PRAGMA user_version''').fetchone()[0]
+    click.echo(f'Database schema is at version {version}.')
+
+
+@click.command('import-transactions')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=50000, show_default=True, help='Rows read at a time.')
+@click.option('--date-column', default='tran_date', show_default=True)
+@click.option('--symbol-column', default='symbol', show_default=True)
+@click.option('--quantity-column', default='quantity', show_default=True)
+@click.option('--price-column', default='share_price', show_default=True)
+@click.option('--type-column', default='tran_type', show_default=True)
+def import_transactions_command(username, path, chunk_size, date_column, symbol_column, quantity_column, price_column, type_column):
+    '''Import a CSV file of transactions for a user. The file is validated in a first pass,
+    then inserted chunk by chunk in one transaction that is committed with the rebuilt positions
+    '''
+    from portfolio_tracker.controller import controller
+    from portfolio_tracker.uploads import MAX_ROW_ERRORS, drop_known, format_errors, read_chunks
+    from portfolio_tracker.userdata import discard_user_data, new_data_key
+
+    db = get_db()
+    user = db.execute('''SELECT * FROM user WHERE username = ? ''', (username,)).fetchone()
+    if user is None:
+        raise click.ClickException(f'User {username} not found.')
+    columns = {'tran_date':date_column,'symbol':symbol_column,'quantity':quantity_column,'share_price':price_column,'tran_type':type_column}
+    start = time.perf_counter()
+
+    # validate the file and find its symbols and first date
+    rows = 0; errors = []; error_count = 0
+    symbols = set(); first_date = None
+    for transactions, chunk_errors in read_chunks(path, columns, chunk_size):
+        rows += len(transactions)
+        error_count += len(chunk_errors)
+        if error_count > 0:
+            errors = sorted(errors + chunk_errors)[:MAX_ROW_ERRORS]
+            continue
+        symbols.update(transactions['symbol'].unique())
+        chunk_first = transactions['tran_date'].min()
+        first_date = chunk_first if first_date is None else min(first_date, chunk_first)
+    if error_count > 0:
+        raise click.ClickException('\n'.join(format_errors(errors, error_count)))
+    if rows == 0:
+        raise click.ClickException('No transactions found.')
+    click.echo(f'Validated {rows} rows in {time.perf_counter()-start:.1f}s.')
+
+    g.user = user
+    new_data_key()
+    try:
+        controller.update_info([])
+        controller.update_info(sorted(symbols))
+        if len(controller.errors) > 0:
+            raise click.ClickException('\n'.join(controller.errors))
+        controller.update_history(sorted(symbols), first_date)
+
+        # insert new rows, skipping those already saved
+        insert_start = time.perf_counter()
+        before_id = db.execute('''SELECT MAX(id) FROM transactions''').fetchone()[0] or 0
+        seen = {}; inserted = 0
+        for transactions, _ in read_chunks(path, columns, chunk_size):
+            new = drop_known(user['id'], transactions, seen, before_id)
+            insert_transactions(db, user['id'], new)
+            inserted += len(new)
+        if inserted == 0:
+            click.echo(f'No new transactions, {rows} already imported.')
+            return
+        db.execute('''UPDATE user SET tran_version = tran_version + 1 WHERE id = ? ''', (user['id'],))
+        insert_time = time.perf_counter()-insert_start
+
+        # rebuild positions once, committing with the inserted rows
+        rebuild_start = time.perf_counter()
+        controller.pending = None
+        controller.update_transactions(None, None)
+        controller.update_positions()
+        if len(controller.errors) == 0:
+            controller.update_database(None, None)
+        if len(controller.errors) > 0:
+            db.rollback()
+            raise click.ClickException('\n'.join(dict.fromkeys(controller.errors)))
+        rebuild_time = time.perf_counter()-rebuild_start
+    finally:
+        discard_user_data() # the import's working copy is not needed after
+
+    total = time.perf_counter()-start
+    click.echo(f'Inserted {inserted} transactions ({rows-inserted} already imported) in {insert_time:.1f}s, {inserted/max(insert_time, 1e-9):,.0f} rows/s.')
+    click.echo(f'Rebuilt positions in {rebuild_time:.1f}s. Imported {rows} rows in {total:.1f}s, {rows/max(total, 1e-9):,.0f} rows/s.')
+
+
 sqlite3.register_converter(
     "timestamp", lambda v: datetime.fromisoformat(v.decode())
 )
 
 def init_app(app):
     app.teardown_appcontext(close_db)
-    app.cli.add_command(init_db_command)
\ No newline at end of file
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(import_transactions_command)
\ No newline at end of file
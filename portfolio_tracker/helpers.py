@@ -3,12 +3,39 @@ import numpy as np
 import pandas as pd
 from portfolio_tracker.db import get_db
 from portfolio_tracker import cache
-from flask import g, Response, session
+from portfolio_tracker.prices import INDEXES, load_history
+from portfolio_tracker.userdata import get_info, get_transactions, version_key
+from flask import g, Response
 from datetime import datetime, timedelta
 import plotly.express as px
 import plotly.graph_objects as go
 import time
 import functools
+import inspect
+import json
+
+def cached_result(f):
+    '''Cache a function's result for the user's current portfolio and price versions and set of
+    excluded symbols. Results with no data (None or a Response) are not cached
+    '''
+    signature = inspect.signature(f)
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        if not g.user:
+            return f(*args, **kwargs)
+        params = signature.bind(*args, **kwargs)
+        params.apply_defaults()
+        params = dict(params.arguments)
+        params['excluded'] = ','.join(sorted(set(filter(None, (params.get('excluded') or '').split(',')))))
+        key = f'derived:{version_key()}:{f.__name__}:{sorted(params.items())}'
+        result = cache.get(key)
+        if result is None:
+            result = f(*args, **kwargs)
+            if result is not None and not isinstance(result, Response):
+                cache.set(key, result)
+        return result
+    return wrapper
 
 def color_positive_green(val):
     '''Return color style based on val
@@ -24,11 +51,24 @@ def color_positive_green(val):
         color = 'black'
     return f'color: {color}'
 
+def load_positions(excluded=None):
+    '''Load the user's positions without the excluded symbols. The database is read once per request
+    '''
+    if 'positions_df' not in g:
+        db = get_db()
+        g.positions_df = pd.read_sql_query('''SELECT * FROM positions WHERE user_id = ? ORDER BY id''', db, params=(g.user['id'],))
+    positions = g.positions_df.copy()
+    if excluded:
+        to_exclude = excluded.split(',')
+        positions = positions[~positions['symbol'].isin(to_exclude)]
+    return positions
+
+@cached_result
 def get_positions_table(excluded=None):
     '''Calculate and format the user's table of positions
     '''
     if g.user:
-        info = session.get('info')
+        info = get_info()
         if not info:
             return ''
         prices = {}
@@ -37,12 +77,7 @@ def get_positions_table(excluded=None):
             prices[symbol] = info[symbol]['price']
             previous_closes[symbol] = info[symbol]['previous_close']
 
-        db = get_db()
-        positions = pd.read_sql_query('''SELECT * FROM positions WHERE user_id = ?''', db, params=(g.user['id'],))
-
-        if excluded:
-            to_exclude = excluded.split(',')
-            positions = positions[~positions['symbol'].isin(to_exclude)]
+        positions = load_positions(excluded)
 
         if len(positions) > 0:
             positions['cost_basis']=positions['cost_basis'].apply(lambda x: round(x,2))
@@ -86,57 +121,130 @@ def get_positions_table(excluded=None):
         else:
             return ''
 
-def calculate_value_history(transactions_df, history):
-    ''' Calculate user's portfolio value history, adjusting for buy/sell transactions
+def get_price_history(transactions_df):
+    '''Load price history for the user's symbols and the comparison indexes from the shared price store
+    '''
+    symbols = list(transactions_df['symbol'].unique()) + INDEXES
+    return load_history(symbols, min(transactions_df['tran_date']))
+
+def calculate_contributions(transactions_df, history):
+    ''' Calculate each symbol's contribution to the portfolio value history: dates x symbols matrices of
+    the value and cumulative cost of the shares held, and each symbol's buy and sell totals.
+    Trades on days without prices count from the next price date and trades after the last are ignored
     '''
-    transactions_df['cost'] = transactions_df['quantity']*transactions_df['share_price']
-    trades=transactions_df.groupby(['tran_date','symbol'],as_index=False).agg({'quantity':'sum','cost':'sum'})
-    trades['tran_date']=pd.to_datetime(trades['tran_date'])
     history.index = pd.to_datetime(history.index)
-    trades=trades.pivot(columns='symbol',index='tran_date')
-    total_cost = sum(transactions_df.apply(lambda x: abs(x['quantity'])*x['share_price'] if x['tran_type'] == 'BUY' else 0, axis=1))
-    total_sell = sum(transactions_df.apply(lambda x: abs(x['quantity'])*x['share_price'] if x['tran_type'] == 'SELL' else 0, axis=1))
-
-    # quantity history
-    qhistory=pd.DataFrame(index=history.index).merge(trades['quantity'],left_index=True, right_index=True,how='outer')
-    qhistory=qhistory.fillna(0).cumsum(axis=0)
-    qhistory=qhistory[qhistory.index.isin(history.index)]
-    value_history=pd.DataFrame((history*qhistory).sum(axis=1), columns=['value'])
-
-    # cost history
-    chistory=pd.DataFrame(index=history.index).merge(trades['cost'],left_index=True, right_index=True,how='outer')
-    chistory=chistory.fillna(0).cumsum(axis=0)
-    chistory=chistory[chistory.index.isin(history.index)]
-    cost_history = pd.DataFrame(chistory.sum(axis=1),columns=['cost'])
+    dates = history.index.to_numpy()
+    quantity = transactions_df['quantity'].to_numpy(dtype=float)
+    share_price = transactions_df['share_price'].to_numpy(dtype=float)
+    cost = quantity*share_price
+    tran_type = transactions_df['tran_type'].to_numpy()
+    codes, symbols = pd.factorize(transactions_df['symbol'], sort=True)
+    bought = np.bincount(codes, weights=np.where(tran_type == 'BUY', np.abs(cost), 0), minlength=len(symbols))
+    sold = np.bincount(codes, weights=np.where(tran_type == 'SELL', np.abs(cost), 0), minlength=len(symbols))
+
+    # map each trade to its cell in the dates x symbols matrices
+    rows = np.searchsorted(dates, pd.to_datetime(transactions_df['tran_date']).to_numpy())
+    on_calendar = rows < len(dates)
+    cells = rows[on_calendar]*len(symbols)+codes[on_calendar]
+
+    # quantity and cost history, valued at prices of 0 for symbols without a price history
+    qhistory = np.bincount(cells, weights=quantity[on_calendar], minlength=len(dates)*len(symbols))
+    qhistory = np.cumsum(qhistory.reshape(len(dates), len(symbols)), axis=0)
+    chistory = np.bincount(cells, weights=cost[on_calendar], minlength=len(dates)*len(symbols))
+    chistory = np.cumsum(chistory.reshape(len(dates), len(symbols)), axis=0)
+    prices = history.reindex(columns=symbols).to_numpy(dtype=float, na_value=0)
+    value = prices*qhistory
+    held = value != 0
+
+    return {
+        'index': history.index,
+        'symbols': symbols,
+        'value': value,
+        'cost': chistory,
+        'total_value': value.sum(axis=1),
+        'total_cost': chistory.sum(axis=1),
+        'bought': bought,
+        'sold': sold,
+        'first_held': np.where(held.any(axis=0), held.argmax(axis=0), len(dates)), # first row each symbol has value
+    }
+
+def combine_contributions(contributions, excluded=None):
+    ''' Combine the contributions of the symbols not excluded into a value history, or None if none are
+    held. Excluded columns are subtracted from the totals unless adding up the rest touches fewer columns
+    '''
+    symbols = contributions['symbols']
+    excluded = symbols.isin(excluded or [])
+    included = ~excluded
+    start_ind = contributions['first_held'][included].min(initial=len(contributions['index']))
+    if start_ind == len(contributions['index']):
+        return None
+
+    if excluded.sum() == 0:
+        value, cost = contributions['total_value'], contributions['total_cost']
+    elif excluded.sum() < included.sum():
+        value = contributions['total_value']-contributions['value'][:, excluded].sum(axis=1)
+        cost = contributions['total_cost']-contributions['cost'][:, excluded].sum(axis=1)
+    else:
+        value = contributions['value'][:, included].sum(axis=1)
+        cost = contributions['cost'][:, included].sum(axis=1)
+    total_cost = contributions['bought'][included].sum()
+    total_sell = contributions['sold'][included].sum()
 
     # Adjustments
-    value_history = value_history.merge(cost_history,left_index=True, right_index=True)
-    value_history['adj_value'] = value_history['value']-value_history['cost']+total_cost-total_sell
-    value_history['adj_value2'] = value_history['value']-value_history['cost']+total_cost
-    start_ind = value_history[value_history['value'] != 0].index[0]
-    value_history = value_history[start_ind:]
-    return value_history
+    value_history = pd.DataFrame({
+        'value': value,
+        'cost': cost,
+        'adj_value': value-cost+total_cost-total_sell,
+        'adj_value2': value-cost+total_cost,
+    }, index=contributions['index'])
+    return value_history.iloc[start_ind:]
 
+def calculate_value_history(transactions_df, history):
+    ''' Calculate user's portfolio value history, adjusting for buy/sell transactions
+    '''
+    return combine_contributions(calculate_contributions(transactions_df, history))
+
+@cached_result
+def get_contributions():
+    '''Load price history and calculate each symbol's contributions to the value history of the user's
+    transactions. Returns the contributions and the comparison indexes' price history, or None if there
+    are no transactions
+    '''
+    transactions_df = get_transactions()
+    if transactions_df is None or len(transactions_df) == 0:
+        return None
+    history = get_price_history(transactions_df)
+    return calculate_contributions(transactions_df, history), history[INDEXES] # the symbols' prices are in the contributions
+
+@cached_result
+def get_value_history(excluded=None):
+    '''Calculate the value history of the user's transactions without the excluded symbols from the
+    cached contributions. Returns the value history and the comparison indexes' price history, or None
+    if there are no transactions
+    '''
+    loaded = get_contributions()
+    if loaded is None:
+        return None
+    contributions, history = loaded
+    value_history = combine_contributions(contributions, excluded.split(',') if excluded else None)
+    if value_history is None: # all symbols excluded
+        return None
+    return value_history, history
+
+@cached_result
 def get_history_graph(timeframe, adj=False, comp=None, excluded=None):
     '''Calculate and format the user's portfolio history graph
     '''
     if comp == 'undefined':
         comp = None
     if g.user:
-        history = pd.DataFrame(session.get('history'))
-        transactions_df = pd.DataFrame(session.get('transactions_df'))
-        info = session.get('info')
+        info = get_info()
         if not info:
             return Response(status=204)
 
-        if isinstance(transactions_df, pd.DataFrame) and len(transactions_df) > 0:
-            if excluded:
-                to_exclude = excluded.split(',')
-                transactions_df = transactions_df[~transactions_df['symbol'].isin(to_exclude)]
-                if len(transactions_df) == 0:
-                    return Response(status=204)
-
-            value_history = calculate_value_history(transactions_df, history)
+        loaded = get_value_history(excluded)
+        if loaded is not None:
+            value_history, history = loaded
             value_history['value']=pd.to_numeric(value_history['value'])
             
             # timeframe
@@ -200,21 +308,18 @@ def get_history_graph(timeframe, adj=False, comp=None, excluded=None):
         else:
             return Response(status=204)
 
+@cached_result
 def get_allocations_graph(disp, excluded=None):
     '''Calculate and format the sector/asset allocation chart
     '''
     if g.user:
         
         # get positions
-        db = get_db()
-        info = session.get('info')
+        info = get_info()
         if not info:
             return Response(status=204)
         
-        positions = positions=pd.read_sql_query('''SELECT * FROM positions WHERE user_id = ?''',db,params=(g.user['id'],))
-        if excluded:
-            to_exclude = excluded.split(',')
-            positions = positions[~positions['symbol'].isin(to_exclude)]
+        positions = load_positions(excluded)
 
         if len(positions) > 0:
             
@@ -295,14 +400,10 @@ def get_summary_numbers(excluded=None):
     '''
     if g.user:
 
-        db = get_db()
-        positions = positions=pd.read_sql_query('''SELECT * FROM positions WHERE user_id = ?''',db,params=(g.user['id'],))
-        if excluded:
-            to_exclude = excluded.split(',')
-            positions = positions[~positions['symbol'].isin(to_exclude)]
+        positions = load_positions(excluded)
         prices = {}
         previous_closes = {}
-        info = session.get('info')
+        info = get_info()
         if not info:
             return None, None, None, None, None
         for symbol in info.keys():
@@ -346,6 +447,7 @@ def get_summary_numbers(excluded=None):
     else:
         return None, None, None, None, None
 
+@cached_result
 def get_summary_numbers2(excluded=None):
     '''Return summary numbers in json format
     '''
@@ -358,130 +460,341 @@ def get_summary_numbers2(excluded=None):
         'tot_col':tot_col
     }
 
-def calc_ror(data, offset):
-    '''Calculate rate of return given value history and day offset
+METRIC_WINDOWS = [30,91,182,365,1095,'all'] # days, or all of the history
+METRIC_LABELS = ['1M','3M','6M','1Y','3Y','All']
+PERCENT_METRICS = ('Annualized ROR','Volatility','Max Drawdown','VaR (95%)','CVaR (95%)') # shown as percentages
+CORRELATION_INDEXES = ['^GSPC','^DJI','^IXIC'] # comparison indexes, without the treasury yield
+
+def window_start(index, offset):
+    '''Get the first row of index within offset days of today, or None if index starts after that
     '''
-    if offset == 'all':
-        offset = (data.index[-1]-data.index[0]).days
     start = datetime.today()-timedelta(days=int(offset))
-    if start < data.index[0]:
-        return 0
-    data = data[data.index >= start]
-    total_r=data.iloc[-1]/data.iloc[0]
-    N = offset/365.25
-    return total_r**(1/N)-1
-
-def simple_linear_regression(x, y):
-    '''Simple linear regression  
-    '''
-    n = len(x)
-    
-    mean_x = np.mean(x)
-    mean_y = np.mean(y)
-    
-    numerator = np.sum((x - mean_x) * (y - mean_y))
-    denominator = np.sum((x - mean_x)**2)
-    
-    if denominator == 0:  
-        return 0, mean_y  
-    
-    m = numerator / denominator
-    c = mean_y - m * mean_x
-    
-    return m, c
+    if start < index[0]:
+        return None
+    return index.searchsorted(start)
 
-def calc_beta_alpha(data, col, offset):
-    '''Calculate beta and alpha of portfolio given value history and time period offset
+def daily_returns(values):
+    '''Calculate daily returns, where row i is the return from row i-1. Returns the returns, with 0 where a
+    return is undefined, and a mask of the defined ones
     '''
-    if offset != 'all':
-        start = datetime.today()-timedelta(days=int(offset))
-        if start < data.index[0]:
-            return 0,0
-        data = data[data.index >= start]
-    porto_returns = data[col].pct_change().dropna()
-    comp_returns = data['s&p'].pct_change().dropna()
-    beta, alpha = simple_linear_regression(comp_returns, porto_returns)
-    return beta, alpha
-
-def calculate_sharpe_ratio(data, col, offset):
-    '''Calculate sharpe ratio given value history and time period offset
+    values = np.asarray(values, dtype=float)
+    returns = np.zeros(len(values))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = values[1:]/values[:-1]-1
+    defined = ~np.isnan(returns)
+    defined[:1] = False
+    returns[~defined] = 0
+    return returns, defined
+
+def prefix_sums(*columns):
+    '''Cumulative sums of columns with a leading row of zeros, so rows i to j-1 of each sum to sums[j]-sums[i]
     '''
-    if offset != 'all':
-        start = datetime.today()-timedelta(days=int(offset))
-        if start < data.index[0]:
-            return 0
-        data = data[data.index >= start]
-    rx = np.mean(data[col].pct_change().dropna())
-    rf = np.mean(data['tips'])/100/252
-    std = np.std(data[col].pct_change().dropna())
-    return ((rx-rf)/std)*np.sqrt(252)
+    sums = np.zeros((len(columns[0])+1, len(columns)))
+    np.cumsum(np.column_stack(columns), axis=0, out=sums[1:])
+    return sums
 
+def drawdowns(values):
+    '''Calculate the fall of each value from the highest value before it
+    '''
+    return values/np.maximum.accumulate(values)-1
+
+def calc_window_metrics(data, ror_col, beta_col, risk_col, windows=METRIC_WINDOWS):
+    '''Calculate metrics for each window of days ending today: the annualized ROR of ror_col, the beta and
+    alpha of beta_col's daily returns against the S&P 500's, and the Sharpe and Sortino ratios, annualized
+    volatility, max drawdown, Calmar ratio and one day 95% historical VaR and CVaR of risk_col.
+    Returns are computed once and summed into prefix sums, so the ratios cost O(1) per window after one
+    pass over the value history. Returns a dict of metric name -> list of values, one per window
+    '''
+    index = data.index
+    n = len(index)
+    x, x_ok = daily_returns(data['s&p'])
+    y, y_ok = daily_returns(data[beta_col])
+    pairs = x_ok & y_ok
+    r, r_ok = daily_returns(data[risk_col])
+    downside = np.minimum(r, 0)
+    sums = prefix_sums(x_ok, x, x*x, y_ok, y, pairs, x*pairs, y*pairs, x*y*pairs, r_ok, r, r*r, downside*downside, data['tips'])
+    ror_values = data[ror_col].to_numpy(dtype=float)
+    risk_values = data[risk_col].to_numpy(dtype=float)
+
+    metrics = {name: [] for name in ['Annualized ROR','Beta','Alpha','Sharpe Ratio','Sortino Ratio','Volatility',
+                                     'Max Drawdown','Calmar Ratio','VaR (95%)','CVaR (95%)']}
+    for offset in windows:
+        # annualized rate of return, with 'all' measured over the days from the first to the last date
+        days = (index[-1]-index[0]).days if offset == 'all' else offset
+        start = window_start(index, days)
+        if start is None or start >= n or days == 0:
+            ror = 0
+        else:
+            ror = (ror_values[-1]/ror_values[start])**(1/(days/365.25))-1
+        metrics['Annualized ROR'].append(ror)
+
+        start = 0 if offset == 'all' else window_start(index, offset)
+        if start is None or start >= n:
+            for name in metrics:
+                if name != 'Annualized ROR':
+                    metrics[name].append(0)
+            continue
+        nx, sx, sxx, ny, sy, nxy, px, py, pxy, nr, sr, srr, sdd, _ = sums[n]-sums[min(start+1, n)] # returns within the window
+        tips = (sums[n, -1]-sums[start, -1])/(n-start)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_x, mean_y, mean_r = np.float64(sx)/nx, np.float64(sy)/ny, np.float64(sr)/nr
+
+            # least squares fit of the portfolio's returns to the S&P 500's
+            denominator = sxx-sx*mean_x if nx > 1 else 0
+            if denominator == 0:
+                beta = 0
+            else:
+                beta = (pxy-mean_y*px-mean_x*py+nxy*mean_x*mean_y)/denominator
+            metrics['Beta'].append(beta)
+            metrics['Alpha'].append(mean_y-beta*mean_x if beta else mean_y)
+
+            std = np.sqrt(max(srr/nr-mean_r**2, 0)) if nr > 0 else np.nan
+            downside_std = np.sqrt(sdd/nr) if nr > 0 else np.nan
+            excess = mean_r-tips/100/252
+            metrics['Sharpe Ratio'].append((excess/std)*np.sqrt(252))
+            metrics['Sortino Ratio'].append((excess/downside_std)*np.sqrt(252))
+            metrics['Volatility'].append(std*np.sqrt(252))
+
+        max_drawdown = drawdowns(risk_values[start:]).min()
+        metrics['Max Drawdown'].append(max_drawdown)
+        metrics['Calmar Ratio'].append(ror/-max_drawdown if max_drawdown < 0 else 0)
+
+        # historical VaR and CVaR: the 5th percentile daily loss and the average loss beyond it
+        returns = np.sort(r[start+1:][r_ok[start+1:]])
+        if len(returns) == 0:
+            metrics['VaR (95%)'].append(0)
+            metrics['CVaR (95%)'].append(0)
+            continue
+        cutoff = max(int(np.ceil(len(returns)*0.05)), 1)
+        metrics['VaR (95%)'].append(-returns[cutoff-1])
+        metrics['CVaR (95%)'].append(-returns[:cutoff].mean())
+    return metrics
+
+def calc_rolling_beta(data, col, days=63):
+    '''Calculate the beta of col's daily returns against the S&P 500's over each trailing window of days
+    rows, from one set of prefix sums
+    '''
+    x, x_ok = daily_returns(data['s&p'])
+    y, y_ok = daily_returns(data[col])
+    pairs = x_ok & y_ok
+    sums = prefix_sums(x_ok, x, x*x, y_ok, y, pairs, x*pairs, y*pairs, x*y*pairs)
+    nx, sx, sxx, ny, sy, nxy, px, py, pxy = (sums[days+1:]-sums[1:-days]).T if len(data) > days else np.zeros((9, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x, mean_y = sx/nx, sy/ny
+        denominator = sxx-sx*mean_x
+        beta = np.where(denominator > 0, (pxy-mean_y*px-mean_x*py+nxy*mean_x*mean_y)/denominator, 0)
+    return pd.Series(beta, index=data.index[days:])
+
+def calc_attribution(contributions, value_history, excluded=None, windows=METRIC_WINDOWS):
+    '''Break the portfolio's return over each window of days ending today down into each symbol's
+    contribution: the change in its value less the cost of its trades in the window, over the portfolio's
+    adjusted value at the start of the window, so the contributions add up to the portfolio's return.
+    Returns a symbols x windows frame, with NaN for windows that start before value_history
+    '''
+    included = ~contributions['symbols'].isin(excluded or [])
+    gain = contributions['value'][:, included]-contributions['cost'][:, included]
+    gain = gain[len(gain)-len(value_history):] # align with the value history's rows
+
+    starts = [0 if offset == 'all' else window_start(value_history.index, offset) for offset in windows]
+    in_history = np.array([start is not None and start < len(value_history) for start in starts])
+    starts = np.where(in_history, [start or 0 for start in starts], 0).astype(int)
+    base = value_history['adj_value2'].to_numpy(dtype=float)[starts]
+    attribution = (gain[-1]-gain[starts])/base[:, None]
+    attribution[~in_history] = np.nan
+    labels = dict(zip(METRIC_WINDOWS, METRIC_LABELS))
+    return pd.DataFrame(attribution.T, index=contributions['symbols'][included], columns=[labels.get(offset, f'{offset}D') for offset in windows])
+
+def calc_covariance(prices):
+    '''Calculate the annualized covariance and the correlation matrices of the daily returns of each column
+    of prices with one matrix product. Columns with no variance have a correlation of 0
+    '''
+    values = prices.to_numpy(dtype=float)
+    returns = values[1:]/values[:-1]-1
+    returns -= returns.mean(axis=0)
+    covariance = returns.T @ returns/max(len(returns)-1, 1)
+    std = np.sqrt(np.diag(covariance))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = np.nan_to_num(covariance/np.outer(std, std))
+    return covariance*252, correlation
+
+@cached_result
 def get_metrics(comp=None, excluded=None):
     if comp == 'undefined':
         comp = None
     if g.user:
     
-        history = pd.DataFrame(session.get('history'))
-        transactions_df = pd.DataFrame(session.get('transactions_df'))
+        transactions_df = get_transactions()
         if isinstance(transactions_df, pd.DataFrame) and len(transactions_df) > 0:
-            if excluded:
-                to_exclude = excluded.split(',')
-                transactions_df = transactions_df[~transactions_df['symbol'].isin(to_exclude)]
-                if len(transactions_df) == 0:
-                    return Response(status=204)
-
-            value_history = calculate_value_history(transactions_df, history)
+            loaded = get_value_history(excluded)
+            if loaded is None: # all symbols excluded
+                return Response(status=204)
+            value_history, history = loaded
             value_history['s&p'] = history['^GSPC']
             value_history['dji'] = history['^DJI']
             value_history['nasdaq'] = history['^IXIC']
             value_history['tips'] = history['^TNX']
-            ror = [calc_ror(value_history['adj_value2'], off) for off in [30,91,182,365,1095,'all']]
-            alpha_beta = [calc_beta_alpha(value_history, 'value', off) for off in [30,91,182,365,1095,'all']]
-            sharpe = [calculate_sharpe_ratio(value_history,'adj_value2', off) for off in [30,91,182,365,1095,'all']]
+            metrics = calc_window_metrics(value_history, 'adj_value2', 'value', 'adj_value2')
             
+            # interleave the comparison's rows
             if comp:
-                ror_comp = [calc_ror(value_history['s&p'], off) for off in [30,91,182,365,1095,'all']]
-                alpha_beta_comp = [calc_beta_alpha(value_history, comp, off) for off in [30,91,182,365,1095,'all']]
-                sharpe_comp = [calculate_sharpe_ratio(value_history, comp, off) for off in [30,91,182,365,1095,'all']]
-                metrics=pd.concat([pd.DataFrame(ror).T, pd.DataFrame(ror_comp).T, pd.DataFrame(alpha_beta).T, pd.DataFrame(alpha_beta_comp).T, pd.DataFrame(sharpe).T, pd.DataFrame(sharpe_comp).T])
-                metrics.index=['Annualized ROR',comp.upper()+' Annualized ROR','Beta','Alpha',comp.upper()+' Beta',comp.upper()+' Alpha','Sharpe Ratio',comp.upper()+' Sharpe Ratio']
-                metrics = metrics.reindex(['Annualized ROR',comp.upper()+' Annualized ROR','Beta',comp.upper()+' Beta','Alpha',comp.upper()+' Alpha','Sharpe Ratio',comp.upper()+' Sharpe Ratio'])
-            else:
-                metrics=pd.concat([pd.DataFrame(ror).T, pd.DataFrame(alpha_beta).T, pd.DataFrame(sharpe).T])
-                metrics.index=['Annualized ROR','Beta','Alpha','Sharpe Ratio']
-            metrics.columns=['1M','3M','6M','1Y','3Y','All']
+                comp_metrics = calc_window_metrics(value_history, comp, comp, comp)
+                metrics = {row: values for name in metrics
+                           for row, values in [(name, metrics[name]), (comp.upper()+' '+name, comp_metrics[name])]}
+            metrics = pd.DataFrame.from_dict(metrics, orient='index', columns=METRIC_LABELS)
+            ror_rows = [row for row in metrics.index if row.endswith('Annualized ROR')]
+            percent_rows = [row for row in metrics.index if row.endswith(PERCENT_METRICS)]
+            ratio_rows = [row for row in metrics.index if row not in percent_rows]
             styles = [
                 dict(selector="th", props=[("font-size", "12px")]) 
             ]
             
-            # Format table with comparison
-            if comp:
-                html = (
-                    metrics.style
-                    .set_properties(**{'font-size': '10pt'})
-                    .map(color_positive_green, subset=(['Annualized ROR',comp.upper()+' Annualized ROR'], slice(None)))
-                    .format("{:.2%}", subset=(['Annualized ROR',comp.upper()+' Annualized ROR'], slice(None)))
-                    .format("{:.3f}", subset=(['Beta',comp.upper()+' Beta','Alpha',comp.upper()+' Alpha','Sharpe Ratio',comp.upper()+' Sharpe Ratio'], slice(None)))
-                    .set_table_styles(styles)
-                    .set_properties(header="true", justify='left')
-                    .set_table_attributes('class="table table-hover table-striped table-sm"')
-                    .to_html()
-                )
-            
-            # format table with no comparison
-            else:
-                html = (
-                    metrics.style
-                    .set_properties(**{'font-size': '10pt'})
-                    .map(color_positive_green, subset=(['Annualized ROR'], slice(None)))
-                    .format("{:.2%}", subset=(['Annualized ROR'], slice(None)))
-                    .format("{:.3f}", subset=(['Beta','Alpha','Sharpe Ratio'], slice(None)))
-                    .set_table_styles(styles)
-                    .set_properties(header="true", justify='left')
-                    .set_table_attributes('class="table table-hover table-sm"')
-                    .to_html()
-                )
+            html = (
+                metrics.style
+                .set_properties(**{'font-size': '10pt'})
+                .map(color_positive_green, subset=(ror_rows, slice(None)))
+                .format("{:.2%}", subset=(percent_rows, slice(None)))
+                .format("{:.3f}", subset=(ratio_rows, slice(None)))
+                .set_table_styles(styles)
+                .set_properties(header="true", justify='left')
+                .set_table_attributes('class="table table-hover table-striped table-sm"' if comp else 'class="table table-hover table-sm"')
+                .to_html()
+            )
             
             return html
         else:
-            return ''
\ No newline at end of file
+            return ''
+
+@cached_result
+def get_rolling_beta_graph(comp=None, excluded=None):
+    '''Calculate and format the graph of the portfolio's 3 month rolling beta, and the comparison's
+    '''
+    if comp == 'undefined':
+        comp = None
+    if g.user:
+        loaded = get_value_history(excluded)
+        if loaded is None:
+            return Response(status=204)
+        value_history, history = loaded
+        value_history['s&p'] = history['^GSPC']
+        value_history['dji'] = history['^DJI']
+        value_history['nasdaq'] = history['^IXIC']
+
+        fig = go.Figure()
+        for col, name, color in [('value', 'Your Portfolio', 'green'), (comp, (comp or '').upper(), 'blue')]:
+            if col:
+                beta = calc_rolling_beta(value_history, col)
+                fig.add_trace(go.Scatter(
+                    x=beta.index,
+                    y=beta.values.tolist(),
+                    mode='lines',
+                    name=name,
+                    line=dict(color=color, width=1.5)
+                ))
+        fig.update_layout(
+            template='plotly_white',
+            margin=dict(l=20, r=20, t=20, b=20),
+            autosize=True,
+            height=200,
+            showlegend=False,
+            yaxis_tickformat = '.2f'
+        )
+        return fig.to_json()
+
+@cached_result
+def get_attribution_table(excluded=None):
+    '''Calculate and format the table of each holding's contribution to the portfolio's return
+    '''
+    if g.user:
+        loaded = get_value_history(excluded)
+        if loaded is None:
+            return ''
+        value_history, _ = loaded
+        contributions, _ = get_contributions()
+        attribution = calc_attribution(contributions, value_history, excluded.split(',') if excluded else None)
+        attribution = attribution[(attribution.fillna(0) != 0).any(axis=1)]
+        attribution = attribution.sort_values(METRIC_LABELS[-1], ascending=False)
+        attribution.loc['Total'] = attribution.sum(min_count=1)
+        styles = [
+            dict(selector="th", props=[("font-size", "12px")]) 
+        ]
+
+        html = (
+            attribution.style
+            .set_properties(**{'font-size': '10pt'})
+            .map(color_positive_green)
+            .format("{:.2%}", na_rep='')
+            .set_table_styles(styles)
+            .set_properties(header="true", justify='left')
+            .set_table_attributes('class="table table-hover table-sm"')
+            .to_html()
+        )
+        return html
+
+@cached_result
+def get_correlations(timeframe=None, excluded=None):
+    '''Calculate the correlation and annualized covariance matrices of the daily returns of the user's
+    current holdings and the comparison indexes over the last timeframe days, and the portfolio's annualized
+    volatility at current weights. Only the prices of the holdings and indexes since the user's first
+    transaction are loaded. Returns None if there are no holdings with price history
+    '''
+    if g.user:
+        positions = load_positions(excluded)
+        positions = positions[positions['quantity'] > 0]
+        if len(positions) == 0:
+            return None
+        db = get_db()
+        first_date = db.execute('''SELECT MIN(tran_date) FROM transactions WHERE user_id = ? ''', (g.user['id'],)).fetchone()[0]
+        history = load_history(list(positions['symbol'])+CORRELATION_INDEXES, first_date)
+        positions = positions[positions['symbol'].isin(history.columns)]
+        if len(positions) == 0:
+            return None
+        symbols = list(positions['symbol'])
+        indexes = [symbol for symbol in CORRELATION_INDEXES if symbol in history.columns]
+        prices = history[symbols+indexes]
+        try:
+            start = window_start(prices.index, timeframe)
+            if start is not None:
+                prices = prices.iloc[max(start-1, 0):] # include the day before for the first return
+        except (TypeError, ValueError):
+            pass
+        if len(prices) < 3:
+            return None
+        covariance, correlation = calc_covariance(prices)
+
+        # weights at the latest prices, falling back to the last close
+        info = get_info() or {}
+        last_prices = positions['symbol'].map({symbol: info[symbol].get('price') for symbol in info})
+        last_prices = last_prices.fillna(positions['symbol'].map(prices.iloc[-1]))
+        market_values = (positions['quantity']*last_prices).to_numpy(dtype=float)
+        weights = market_values/market_values.sum()
+        held = covariance[:len(symbols), :len(symbols)]
+        return {
+            'symbols': symbols+indexes,
+            'weights': weights.tolist()+[0]*len(indexes),
+            'start': prices.index[0].strftime('%Y-%m-%d'),
+            'end': prices.index[-1].strftime('%Y-%m-%d'),
+            'correlation': correlation.tolist(),
+            'covariance': covariance.tolist(),
+            'volatility': float(np.sqrt(max(weights @ held @ weights, 0))),
+        }
+
+def get_dashboard(timeframe, adj=False, comp=None, disp='sector', excluded=None):
+    '''Calculate the history, allocations and rolling beta graphs, positions, metrics and attribution tables
+    and summary numbers in one pass, sharing the loaded positions and value history. Returns the JSON body
+    of all of them, with graphs set to null and tables empty when there is no data
+    '''
+    history = get_history_graph(timeframe, adj, comp, excluded)
+    allocations = get_allocations_graph(disp, excluded)
+    metrics = get_metrics(comp, excluded)
+    rolling_beta = get_rolling_beta_graph(comp, excluded)
+    attribution = get_attribution_table(excluded)
+    parts = {
+        'history': 'null' if isinstance(history, Response) else history,
+        'allocations': 'null' if isinstance(allocations, Response) else allocations,
+        'positions': json.dumps(get_positions_table(excluded)),
+        'metrics': json.dumps('' if isinstance(metrics, Response) else metrics),
+        'rolling_beta': 'null' if isinstance(rolling_beta, Response) else rolling_beta,
+        'attribution': json.dumps(attribution),
+        'summary': json.dumps(get_summary_numbers2(excluded)),
+    }
+    return '{' + ','.join(f'"{name}":{part}' for name, part in parts.items()) + '}'
@@ -0,0 +1,209 @@
+import struct
+from array import array
+import pandas as pd
+from portfolio_tracker.db import get_db, placeholders
+
+class Position:
+    '''FIFO lots for a symbol. Open lots are stored in quantity and price arrays with a head
+    pointer to the first lot that still has shares. Exhausted lots are dropped as the head moves,
+    and realized lots are kept as running totals
+    '''
+    __slots__ = ('quantity','price','head','realized_quantity','realized_cost','realized_value')
+    header = struct.Struct('<I3d')
+
+    def __init__(self):
+        self.quantity = array('d')
+        self.price = array('d')
+        self.head = 0
+        self.realized_quantity = 0.0
+        self.realized_cost = 0.0
+        self.realized_value = 0.0
+
+    def buy(self, quantity, share_price):
+        '''Open a new lot
+        '''
+        self.quantity.append(quantity)
+        self.price.append(share_price)
+
+    def sell(self, quantity, share_price):
+        '''Sell shares from the oldest open lots first. Returns False if there are not enough shares
+        '''
+        shares_to_sell = quantity
+        while shares_to_sell != 0 and self.head < len(self.quantity):
+            sold = min(shares_to_sell, self.quantity[self.head])
+            shares_to_sell -= sold
+            self.quantity[self.head] -= sold
+            self.realized_quantity += sold
+            self.realized_cost += sold*self.price[self.head]
+            self.realized_value += sold*share_price
+            if self.quantity[self.head] == 0:
+                self.head += 1
+        self._compact()
+        return shares_to_sell == 0
+
+    def _compact(self):
+        '''Drop exhausted lots once they make up most of the arrays
+        '''
+        if self.head > 32 and self.head*2 > len(self.quantity):
+            del self.quantity[:self.head]
+            del self.price[:self.head]
+            self.head = 0
+
+    def totals(self):
+        '''Return the open quantity, cost basis, realized cost basis and realized value
+        '''
+        quantity = 0; cost_basis = 0
+        for i in range(self.head, len(self.quantity)):
+            quantity += self.quantity[i]
+            cost_basis += self.quantity[i]*self.price[i]
+        return quantity, cost_basis, self.realized_cost, self.realized_value
+
+    def to_bytes(self):
+        '''Serialize to a header followed by the open lot quantities and prices
+        '''
+        n = len(self.quantity)-self.head
+        return (self.header.pack(n, self.realized_quantity, self.realized_cost, self.realized_value)
+            + self.quantity[self.head:].tobytes() + self.price[self.head:].tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''Deserialize a position written by to_bytes
+        '''
+        position = cls()
+        n, position.realized_quantity, position.realized_cost, position.realized_value = cls.header.unpack_from(data)
+        offset = cls.header.size
+        position.quantity.frombytes(data[offset:offset+8*n])
+        position.price.frombytes(data[offset+8*n:offset+16*n])
+        return position
+
+    def copy(self):
+        return Position.from_bytes(self.to_bytes())
+
+def decode_positions(data):
+    '''Decode a symbol -> serialized position dict
+    '''
+    return {symbol: Position.from_bytes(position) for symbol, position in (data or {}).items()}
+
+def apply_transaction(position, tran_type, quantity, share_price):
+    '''Apply a split adjusted transaction to a position's FIFO lots.
+    Returns False if there are not enough shares to sell
+    '''
+    if tran_type == 'BUY':
+        position.buy(quantity, share_price)
+    elif tran_type == 'SELL':
+        return position.sell(-quantity, share_price)
+    elif tran_type == 'FEE': # fees realize no value
+        return position.sell(-quantity, 0)
+    return True
+
+def replay_position(transactions_df, position=None, seq=0, every=None):
+    '''Replay one symbol's split adjusted transactions, already in date order, onto a position
+    that has the first seq of them applied. A snapshot is taken every `every` transactions.
+    Returns the position, the snapshots as (seq, tran_date, state) and a list of errors
+    '''
+    if position is None:
+        position = Position()
+    snapshots = []
+    errors = []
+    rows = transactions_df[['tran_date','tran_type','quantity','share_price']].iloc[seq:]
+    for row in rows.itertuples(index=False):
+        if not apply_transaction(position, row.tran_type, row.quantity, row.share_price):
+            errors.append('Not enough shares to sell')
+        seq += 1
+        if every and seq % every == 0:
+            snapshots.append((seq, pd.Timestamp(row.tran_date).strftime('%Y-%m-%d'), position.to_bytes()))
+    return position, snapshots, errors
+
+def replay(transactions_df, every=None):
+    '''Rebuild every symbol's position from split adjusted transactions in date order.
+    Returns the positions, the snapshots for each symbol and a list of errors
+    '''
+    positions = {}
+    snapshots = {}
+    errors = []
+    transactions_df = transactions_df.sort_values('tran_date', kind='stable')
+    for symbol, rows in transactions_df.groupby('symbol', sort=False):
+        positions[symbol], snapshots[symbol], symbol_errors = replay_position(rows, every=every)
+        errors.extend(symbol_errors)
+    return positions, snapshots, errors
+
+def load_snapshot(user_id, symbol, before, splits_digest):
+    '''Load the latest snapshot of a symbol's lots taken before a date with the splits that have the
+    given digest. Returns the number of transactions it covers and the position
+    '''
+    db = get_db()
+    snapshot = db.execute(
+        '''SELECT seq, state FROM lot_snapshots WHERE user_id = ? AND symbol = ? AND tran_date < ? AND splits_digest = ?
+        ORDER BY seq DESC LIMIT 1''',
+        (user_id, symbol, pd.Timestamp(before).strftime('%Y-%m-%d'), splits_digest)
+    ).fetchone()
+    if snapshot is None or not isinstance(snapshot['state'], bytes):
+        return 0, Position()
+    return snapshot['seq'], Position.from_bytes(snapshot['state'])
+
+def save_snapshots(user_id, pending, splits_digests):
+    '''Save snapshots from a replay. pending has 'full' (replace all of the user's snapshots)
+    and 'symbols', mapping symbol -> (seq replayed from, snapshots). Snapshots after seq are replaced.
+    Each snapshot is stamped with the digest in splits_digests of the splits its symbol's lots were
+    adjusted with, so it is not restored after they change. The caller commits
+    '''
+    if pending is None:
+        return
+    db = get_db()
+    if pending['full']:
+        db.execute('''DELETE FROM lot_snapshots WHERE user_id = ? ''', (user_id,))
+    for symbol, (seq, snapshots) in pending['symbols'].items():
+        db.execute('''DELETE FROM lot_snapshots WHERE user_id = ? AND symbol = ? AND seq > ? ''', (user_id, symbol, seq))
+        db.executemany(
+            '''INSERT INTO lot_snapshots (user_id, symbol, seq, tran_date, state, splits_digest) VALUES (?, ?, ?, ?, ?, ?)''',
+            [(user_id, symbol, s, d, state, splits_digests[symbol]) for s, d, state in snapshots]
+        )
+
+def load_lots(user_id, version):
+    '''Load the user's stored lots if they were built for the given version stamp, otherwise None
+    '''
+    db = get_db()
+    stored = db.execute('''SELECT lots_version FROM user WHERE id = ? ''', (user_id,)).fetchone()
+    if stored is None or stored['lots_version'] != version:
+        return None
+    rows = db.execute('''SELECT symbol, state FROM lots WHERE user_id = ? ''', (user_id,)).fetchall()
+    if not all(isinstance(r['state'], bytes) for r in rows): # stored in an older format
+        return None
+    return {r['symbol']: Position.from_bytes(r['state']) for r in rows}
+
+def save_lots(user_id, positions, pending, version):
+    '''Save the lots of the symbols replayed (all symbols if pending is a full replay or None)
+    and stamp them with a version. The caller commits
+    '''
+    db = get_db()
+    positions = positions or {}
+    if pending is None or pending['full']:
+        db.execute('''DELETE FROM lots WHERE user_id = ? ''', (user_id,))
+        symbols = list(positions.keys())
+    else:
+        symbols = list(pending['symbols'].keys())
+        db.execute(f'''DELETE FROM lots WHERE user_id = ? AND symbol IN ({placeholders(symbols)})''', [user_id] + symbols)
+    db.executemany(
+        '''INSERT INTO lots (user_id, symbol, state) VALUES (?, ?, ?)''',
+        [(user_id, symbol, positions[symbol].to_bytes()) for symbol in symbols if symbol in positions]
+    )
+    db.execute('''UPDATE user SET lots_version = ? WHERE id = ? ''', (version, user_id))
+
+def save_positions(user_id, positions):
+    '''Save the totals of the user's positions, writing only the symbols whose totals changed
+    and deleting the symbols no longer held. The caller commits
+    '''
+    db = get_db()
+    stored = {r['symbol']: tuple(r)[1:] for r in db.execute(
+        '''SELECT symbol, quantity, cost_basis, realized_cost_basis, realized_value FROM positions WHERE user_id = ? ''', (user_id,))}
+    totals = {symbol: position.totals() for symbol, position in positions.items()}
+    removed = [symbol for symbol in stored if symbol not in totals]
+    if removed:
+        db.execute(f'''DELETE FROM positions WHERE user_id = ? AND symbol IN ({placeholders(removed)})''', [user_id] + removed)
+    db.executemany(
+        '''INSERT INTO positions (user_id, symbol, quantity, cost_basis, realized_cost_basis, realized_value) 
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, symbol) DO UPDATE SET quantity = excluded.quantity, cost_basis = excluded.cost_basis,
+        realized_cost_basis = excluded.realized_cost_basis, realized_value = excluded.realized_value''',
+        [(user_id, symbol) + t for symbol, t in totals.items() if stored.get(symbol) != t]
+    )
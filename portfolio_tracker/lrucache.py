@@ -0,0 +1,76 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from flask_caching.backends.base import BaseCache
+
+class LRUCache(BaseCache):
+    '''In memory cache that evicts the least recently used entries once the pickled size
+    of all entries is over max_bytes. Select it with CACHE_TYPE and set the size with CACHE_MAX_BYTES
+    '''
+    def __init__(self, max_bytes=64*1024*1024, default_timeout=300):
+        super().__init__(default_timeout=default_timeout)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict() # key -> (expires, pickled value), least recently used first
+        self._lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(dict(max_bytes=config.get('CACHE_MAX_BYTES', 64*1024*1024)))
+        return cls(*args, **kwargs)
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time()+timeout if timeout > 0 else 0
+
+    def _remove(self, key):
+        expires, data = self._entries.pop(key)
+        self.size -= len(data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != 0 and entry[0] <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+        return pickle.loads(entry[1])
+
+    def set(self, key, value, timeout=None):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._expires(timeout), data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+        return True
+
+    def has(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[0] == 0 or entry[0] > time.time())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+        return True
@@ -1,5 +1,5 @@
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, url_for, jsonify, Response, session
+    Blueprint, flash, g, redirect, render_template, request, url_for, jsonify, Response
 )
 
 from werkzeug.exceptions import abort
@@ -7,9 +7,11 @@ import pandas as pd
 from portfolio_tracker.auth import login_required
 from portfolio_tracker.db import get_db
 from portfolio_tracker.helpers import (
-    get_positions_table, get_history_graph, get_allocations_graph, get_summary_numbers, get_summary_numbers2, get_metrics
+    get_positions_table, get_history_graph, get_allocations_graph, get_summary_numbers, get_summary_numbers2, get_metrics,
+    get_rolling_beta_graph, get_attribution_table, get_correlations, get_dashboard
 ) 
 from portfolio_tracker.controller import controller
+from portfolio_tracker.userdata import new_data_key
 
 bp = Blueprint('main', __name__)
 
@@ -63,17 +65,58 @@ def metrics_endpoint():
     excluded = request.args.get('excluded')
     return get_metrics(comp, excluded)
 
+@bp.route('/rolling-beta', methods=('GET','POST'))
+@login_required
+def rolling_beta_endpoint():
+    '''Get rolling beta graph
+    '''
+    comp = request.args.get('comp')
+    if comp == 'sp':
+        comp = 's&p'
+    excluded = request.args.get('excluded')
+    return get_rolling_beta_graph(comp, excluded)
+
+@bp.route('/attribution', methods=('GET','POST'))
+@login_required
+def attribution_endpoint():
+    '''Get return attribution table
+    '''
+    excluded = request.args.get('excluded')
+    return get_attribution_table(excluded)
+
+@bp.route('/correlations', methods=('GET','POST'))
+@login_required
+def correlations_endpoint():
+    '''Get correlation and covariance matrices of holdings and indexes, and portfolio volatility
+    '''
+    timeframe = request.args.get('tf')
+    excluded = request.args.get('excluded')
+    correlations = get_correlations(timeframe, excluded)
+    if correlations is None:
+        return Response(status=204)
+    return jsonify(correlations)
+
+@bp.route('/dashboard', methods=('GET','POST'))
+@login_required
+def dashboard_endpoint():
+    '''Get the history, allocations, positions, metrics and summary together
+    '''
+    timeframe = request.args.get('tf')
+    adj = request.args.get('adj')
+    comp = request.args.get('comp')
+    disp = request.args.get('disp')
+    excluded = request.args.get('excluded')
+    if comp == 'sp':
+        comp = 's&p'
+    return Response(get_dashboard(timeframe, adj, comp, disp, excluded), mimetype='application/json')
+
 @bp.route('/refresh', methods=('GET','POST'))
 def refresh():
     '''Refresh data
     '''
-    session['info'] = None
-    session['positions'] = {}
-    session['transactions_df'] = None
-    controller.update_info([])
-    controller.update_transactions(None,None)
-    controller.update_positions()
-    controller.update_database(None,None)
+    new_data_key()
+    controller.update_info([], refresh=['quote'])
+    controller.load_user_data()
     return redirect(url_for("main.index")) 
 
 @bp.route('/users', methods=('GET','POST'))
@@ -0,0 +1,60 @@
+import json
+from datetime import datetime, timedelta
+from portfolio_tracker.db import get_db, placeholders
+
+# field groups of symbol information, each cached with its own TTL
+FIELD_GROUPS = ['quote','splits','classification']
+
+def load_info(symbols):
+    '''Load cached field groups for symbols from the shared metadata cache.
+    Returns a dict of symbol -> field group -> (data, updated)
+    '''
+    if len(symbols) == 0:
+        return {}
+    db = get_db()
+    rows = db.execute(f'''SELECT symbol, field_group, data, updated FROM symbol_info WHERE symbol IN ({placeholders(symbols)})''', symbols).fetchall()
+    cached = {}
+    for r in rows:
+        cached.setdefault(r['symbol'], {})[r['field_group']] = (json.loads(r['data']), r['updated'])
+    return cached
+
+def get_stale(cached, symbols, ttl, refresh=()):
+    '''Get the field groups for each symbol that are missing, older than their TTL or to be refreshed.
+    Returns a dict of symbol -> field groups
+    '''
+    now = datetime.now()
+    stale = {}
+    for symbol in symbols:
+        groups = []
+        for group in FIELD_GROUPS:
+            entry = cached.get(symbol, {}).get(group)
+            if entry is None or group in refresh or now - entry[1] > timedelta(seconds=ttl[group]):
+                groups.append(group)
+        if len(groups) > 0:
+            stale[symbol] = groups
+    return stale
+
+def save_info(fetched):
+    '''Save fetched field groups (symbol -> field group -> data) to the shared metadata cache
+    '''
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows = [(symbol, group, json.dumps(data), now) for symbol, groups in fetched.items() for group, data in groups.items()]
+    if len(rows) > 0:
+        db = get_db()
+        db.executemany(
+            '''INSERT OR REPLACE INTO symbol_info (symbol, field_group, data, updated) VALUES (?, ?, ?, ?)''',
+            rows
+        )
+        db.commit()
+
+def build_info(cached):
+    '''Combine the cached field groups into an info dict for each symbol that has all of them
+    '''
+    info = {}
+    for symbol, groups in cached.items():
+        if all(group in groups for group in FIELD_GROUPS):
+            symbol_info = {}
+            for group in FIELD_GROUPS:
+                symbol_info.update(groups[group][0])
+            info[symbol] = symbol_info
+    return info
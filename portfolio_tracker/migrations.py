@@ -0,0 +1,103 @@
+from portfolio_tracker.db import fill_content_hashes
+
+def _columns(db, table):
+    return [r['name'] for r in db.execute(f'PRAGMA table_info({table})')]
+
+def _add_column(db, table, column, definition):
+    '''Add a column unless the table already has it
+    '''
+    if column not in _columns(db, table):
+        db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def cache_tables(db):
+    '''Bring a database created before schema versioning up to date: version stamps on users,
+    transaction content hashes and the price, symbol info and lot tables
+    '''
+    _add_column(db, 'user', 'tran_version', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(db, 'user', 'lots_version', 'TEXT')
+    _add_column(db, 'transactions', 'content_hash', 'TEXT')
+    db.execute('''CREATE TABLE IF NOT EXISTS price_history (
+        symbol TEXT NOT NULL,
+        price_date TEXT NOT NULL,
+        close REAL NOT NULL,
+        PRIMARY KEY (symbol, price_date)
+    ) WITHOUT ROWID''')
+    db.execute('''CREATE TABLE IF NOT EXISTS price_coverage (
+        symbol TEXT PRIMARY KEY,
+        start_date TEXT NOT NULL,
+        end_date TEXT NOT NULL
+    )''')
+    db.execute('''CREATE TABLE IF NOT EXISTS symbol_info (
+        symbol TEXT NOT NULL,
+        field_group TEXT NOT NULL,
+        data TEXT NOT NULL,
+        updated TIMESTAMP NOT NULL,
+        PRIMARY KEY (symbol, field_group)
+    )''')
+    db.execute('''CREATE TABLE IF NOT EXISTS lot_snapshots (
+        user_id INTEGER NOT NULL,
+        symbol TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        tran_date TEXT NOT NULL,
+        state BLOB NOT NULL,
+        PRIMARY KEY (user_id, symbol, seq),
+        FOREIGN KEY (user_id) REFERENCES user (id)
+    )''')
+    db.execute('''CREATE TABLE IF NOT EXISTS lots (
+        user_id INTEGER NOT NULL,
+        symbol TEXT NOT NULL,
+        state BLOB NOT NULL,
+        PRIMARY KEY (user_id, symbol),
+        FOREIGN KEY (user_id) REFERENCES user (id)
+    )''')
+    db.execute('''CREATE INDEX IF NOT EXISTS transactions_content_hash ON transactions (user_id, content_hash)''')
+    fill_content_hashes(db)
+
+def transaction_indexes(db):
+    '''Index transactions by user and date and by user and symbol
+    '''
+    db.execute('''CREATE INDEX IF NOT EXISTS transactions_user_date ON transactions (user_id, tran_date)''')
+    db.execute('''CREATE INDEX IF NOT EXISTS transactions_user_symbol ON transactions (user_id, symbol)''')
+    db.execute('''CREATE INDEX IF NOT EXISTS positions_user ON positions (user_id)''')
+
+def unique_positions(db):
+    '''Keep one positions row per user and symbol so positions can be upserted
+    '''
+    db.execute('''DELETE FROM positions WHERE id NOT IN (SELECT MAX(id) FROM positions GROUP BY user_id, symbol)''')
+    db.execute('''DROP INDEX IF EXISTS positions_user''')
+    db.execute('''CREATE UNIQUE INDEX IF NOT EXISTS positions_user_symbol ON positions (user_id, symbol)''')
+
+def snapshot_splits(db):
+    '''Stamp lot snapshots with the splits they were adjusted with. Existing snapshots have no stamp
+    and are never restored, so they are rebuilt on the next replay
+    '''
+    _add_column(db, 'lot_snapshots', 'splits_digest', 'TEXT')
+
+# Migration n brings a database from user_version n-1 to n. Add new migrations to the end
+# and make the same change in schema.sql
+MIGRATIONS = [
+    cache_tables,
+    transaction_indexes,
+    unique_positions,
+    snapshot_splits,
+]
+
+def migrate(db):
+    '''Apply the migrations a database has not had yet, each in its own transaction.
+    Returns the versions applied
+    '''
+    applied = []
+    while True:
+        db.execute('BEGIN IMMEDIATE') # lock out other processes migrating at the same time
+        try:
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                db.rollback()
+                return applied
+            MIGRATIONS[version](db)
+            db.execute(f'PRAGMA user_version = {version+1}')
+            db.commit()
+            applied.append(version+1)
+        except Exception:
+            db.rollback()
+            raise
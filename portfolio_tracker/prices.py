@@ -0,0 +1,81 @@
+import pandas as pd
+from portfolio_tracker.db import get_db, placeholders
+
+INDEXES = ['^GSPC','^DJI','^IXIC','^TNX'] # indexes for comparisons
+
+def get_coverage(symbols):
+    '''Get the cached date range for each symbol in the shared price store. Ranges of symbols
+    without any stored prices, recorded for failed downloads, are ignored so they are fetched again
+    '''
+    if len(symbols) == 0:
+        return {}
+    db = get_db()
+    rows = db.execute(f'''SELECT symbol, start_date, end_date FROM price_coverage
+        WHERE symbol IN ({placeholders(symbols)}) AND EXISTS (SELECT 1 FROM price_history WHERE price_history.symbol = price_coverage.symbol)''', symbols).fetchall()
+    return {r['symbol']: (pd.Timestamp(r['start_date']), pd.Timestamp(r['end_date'])) for r in rows}
+
+def get_missing_ranges(symbols, start, end):
+    '''Work out the date ranges missing from the shared price store for each symbol.
+    Returns a dict of (range start, range end) -> symbols so symbols missing the same
+    range can be fetched together. Range ends are exclusive. Coverage only grows over ranges
+    that downloaded, so a failed head or tail fetch is reported again until it succeeds.
+    '''
+    coverage = get_coverage(symbols)
+    ranges = {}
+    for symbol in symbols:
+        if symbol not in coverage: # new symbol, from first needed date
+            pieces = [(start, end)]
+        else:
+            pieces = []
+            cached_start, cached_end = coverage[symbol]
+            if start < cached_start: # earlier stretch
+                pieces.append((start, cached_start))
+            if cached_end < end: # tail after last cached day, refetching the last day
+                pieces.append((cached_end, end))
+        for piece in pieces:
+            ranges.setdefault(piece, []).append(symbol)
+    return ranges
+
+def save_history(history, symbols, start, end):
+    '''Save a dates x symbols frame of closing prices fetched for symbols to the shared price store
+    and extend the cached date range of each symbol with prices to cover start through end. Symbols
+    that failed to download have no prices and stay missing, unless the range has no trading days
+    '''
+    if len(pd.bdate_range(start, end-pd.Timedelta(days=1))) == 0: # weekend, nothing to wait for
+        covered = list(symbols)
+    else:
+        covered = list(history.columns[history.notna().any()])
+    history = history.copy()
+    history.index = pd.to_datetime(history.index).strftime('%Y-%m-%d')
+    history.index.name = 'price_date'
+    history.columns.name = 'symbol'
+    rows = history.stack().reset_index()
+    rows.columns = ['price_date','symbol','close']
+
+    db = get_db()
+    db.executemany(
+        '''INSERT OR REPLACE INTO price_history (symbol, price_date, close) VALUES (?, ?, ?)''',
+        rows[['symbol','price_date','close']].itertuples(index=False, name=None)
+    )
+    start = start.strftime('%Y-%m-%d')
+    end = end.strftime('%Y-%m-%d')
+    db.executemany(
+        '''INSERT INTO price_coverage (symbol, start_date, end_date) VALUES (?, ?, ?)
+        ON CONFLICT (symbol) DO UPDATE SET start_date = MIN(start_date, excluded.start_date), end_date = MAX(end_date, excluded.end_date)''',
+        [(symbol, start, end) for symbol in covered]
+    )
+    db.commit()
+
+def load_history(symbols, start=None):
+    '''Load closing prices for symbols from the shared price store as a dates x symbols frame
+    '''
+    db = get_db()
+    query = f'''SELECT price_date, symbol, close FROM price_history WHERE symbol IN ({placeholders(symbols)})'''
+    params = list(symbols)
+    if start:
+        query += ''' AND price_date >= ?'''
+        params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+    rows = pd.read_sql_query(query, db, params=params)
+    history = rows.pivot(index='price_date', columns='symbol', values='close').dropna()
+    history.index = pd.to_datetime(history.index)
+    return history
@@ -0,0 +1,208 @@
+import json
+import os
+import zlib
+import click
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from flask import current_app
+from portfolio_tracker.prices import INDEXES
+
+class MarketDataProvider:
+    '''Interface for the market data the app needs. Methods raise an exception
+    if the symbol is not found
+    '''
+    def get_quote(self, symbol):
+        '''Return a dict with the last price and previous close for a symbol
+        '''
+        raise NotImplementedError
+
+    def get_splits(self, symbol):
+        '''Return a dict of split date (YYYY-MM-DD) -> split ratio for a symbol
+        '''
+        raise NotImplementedError
+
+    def get_classification(self, symbol):
+        '''Return sector and asset class distributions for a symbol
+        '''
+        raise NotImplementedError
+
+    def get_closes(self, symbols, start, end=None):
+        '''Return a dates x symbols frame of daily closing prices from start
+        until end (exclusive), or through today if end is None
+        '''
+        raise NotImplementedError
+
+
+class YFinanceProvider(MarketDataProvider):
+    '''Market data from Yahoo Finance
+    '''
+    def get_quote(self, symbol):
+        fast_info = yf.Ticker(symbol).fast_info
+        return {'price': fast_info.last_price, 'previous_close': fast_info.previous_close}
+
+    def get_splits(self, symbol):
+        splits = yf.Ticker(symbol).splits
+        splits.index = splits.index.strftime('%Y-%m-%d')
+        return splits.to_dict()
+
+    def get_classification(self, symbol):
+        ticker = yf.Ticker(symbol)
+        info = ticker.info
+        ttype = info['typeDisp']
+
+        if ttype == 'Equity':
+            sector = info.get('sector')
+            sector = sector.lower().replace(' ','_')
+            sectors = {sector:1.0}
+            assets = {'stockPosition':1.0}
+
+        elif ttype in ['ETF','Fund']:
+            fundsdata = ticker.funds_data
+            sectors = fundsdata.sector_weightings
+            assets = fundsdata.asset_classes
+
+        elif ttype == 'Currency':
+            sectors = {}
+            assets = {'cashPosition':1.0}
+
+        elif ttype == 'Cryptocurrency':
+            sectors = {}
+            assets = {'crypto':1.0}
+
+        return sectors, assets
+
+    def get_closes(self, symbols, start, end=None):
+        tickers=yf.Tickers(' '.join(symbols))
+        history = tickers.history(start=start, end=end, period=None, interval='1d', auto_adjust=False)
+        return history['Close']
+
+
+class FixtureProvider(MarketDataProvider):
+    '''Deterministic market data read from fixture files in a directory:
+    quotes.json, splits.json and classification.json keyed by symbol,
+    and closes.csv with a date column followed by one column per symbol
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.quotes = self._load_json('quotes.json')
+        self.splits = self._load_json('splits.json')
+        self.classification = self._load_json('classification.json')
+        self.closes = pd.read_csv(os.path.join(path, 'closes.csv'), index_col=0, parse_dates=True)
+
+    def _load_json(self, filename):
+        with open(os.path.join(self.path, filename)) as f:
+            return json.load(f)
+
+    def get_quote(self, symbol):
+        return self.quotes[symbol]
+
+    def get_splits(self, symbol):
+        if symbol not in self.quotes:
+            raise KeyError(symbol)
+        return self.splits.get(symbol, {})
+
+    def get_classification(self, symbol):
+        classification = self.classification[symbol]
+        return classification['sectors'], classification['assets']
+
+    def get_closes(self, symbols, start, end=None):
+        closes = self.closes.reindex(columns=symbols)
+        closes = closes[closes.index >= pd.Timestamp(start)]
+        if end:
+            closes = closes[closes.index < pd.Timestamp(end)]
+        return closes
+
+
+class SyntheticProvider(MarketDataProvider):
+    '''Deterministic random walk market data seeded by symbol, for generating fixtures
+    '''
+    origin = '2000-01-03'
+
+    def _walk(self, symbol):
+        dates = pd.bdate_range(self.origin, pd.Timestamp.today().normalize())
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+        start_price = rng.uniform(10, 500)
+        returns = rng.normal(0.0003, 0.015, len(dates))
+        return pd.Series(start_price*np.exp(np.cumsum(returns)), index=dates)
+
+    def get_quote(self, symbol):
+        walk = self._walk(symbol)
+        return {'price': float(walk.iloc[-1]), 'previous_close': float(walk.iloc[-2])}
+
+    def get_splits(self, symbol):
+        return {}
+
+    def get_classification(self, symbol):
+        sectors = ['realestate','consumer_cyclical','basic_materials','consumer_defensive','technology',
+            'communication_services','financial_services','utilities','industrials','energy','healthcare']
+        return {sectors[zlib.crc32(symbol.encode()) % len(sectors)]:1.0}, {'stockPosition':1.0}
+
+    def get_closes(self, symbols, start, end=None):
+        closes = pd.DataFrame({symbol: self._walk(symbol) for symbol in symbols})
+        closes = closes[closes.index >= pd.Timestamp(start)]
+        if end:
+            closes = closes[closes.index < pd.Timestamp(end)]
+        return closes
+
+
+def get_provider():
+    '''Get the market data provider configured for the app, creating it on first use
+    '''
+    if current_app.extensions.get('market_data') is None:
+        current_app.extensions['market_data'] = create_provider(current_app)
+    return current_app.extensions['market_data']
+
+def create_provider(app):
+    '''Create the market data provider selected by MARKET_DATA_PROVIDER
+    '''
+    name = app.config['MARKET_DATA_PROVIDER']
+    if name == 'yfinance':
+        return YFinanceProvider()
+    elif name == 'fixtures':
+        return FixtureProvider(app.config['MARKET_DATA_FIXTURES'])
+    elif name == 'synthetic':
+        return SyntheticProvider()
+    raise ValueError(f'Unknown market data provider {name}')
+
+def write_fixtures(provider, symbols, start, path):
+    '''Write fixture files for symbols from start through today using a provider
+    '''
+    os.makedirs(path, exist_ok=True)
+    quotes = {}; splits = {}; classification = {}
+    for symbol in symbols:
+        try:
+            quotes[symbol] = provider.get_quote(symbol)
+            splits[symbol] = provider.get_splits(symbol)
+            sectors, assets = provider.get_classification(symbol)
+            classification[symbol] = {'sectors': sectors, 'assets': assets}
+        except Exception:
+            quotes.pop(symbol, None)
+            splits.pop(symbol, None)
+            click.echo(f'Skipped {symbol}, not found.')
+    for filename, data in [('quotes.json', quotes), ('splits.json', splits), ('classification.json', classification)]:
+        with open(os.path.join(path, filename), 'w') as f:
+            json.dump(data, f, indent=2)
+    closes = provider.get_closes(symbols, start)
+    closes.index = pd.to_datetime(closes.index).strftime('%Y-%m-%d')
+    closes.index.name = 'Date'
+    closes.to_csv(os.path.join(path, 'closes.csv'))
+
+
+@click.command('record-fixtures')
+@click.argument('symbols', nargs=-1, required=True)
+@click.option('--start', default='2015-01-01', help='First date of closing prices.')
+@click.option('--path', default=None, help='Fixture directory, defaults to MARKET_DATA_FIXTURES.')
+@click.option('--synthetic', is_flag=True, help='Generate random walk data instead of recording from Yahoo Finance.')
+def record_fixtures_command(symbols, start, path, synthetic):
+    '''Record market data fixtures for symbols and the comparison indexes
+    '''
+    provider = SyntheticProvider() if synthetic else YFinanceProvider()
+    path = path or current_app.config['MARKET_DATA_FIXTURES']
+    write_fixtures(provider, list(dict.fromkeys(list(symbols) + INDEXES)), start, path)
+    click.echo(f'Wrote fixtures to {path}.')
+
+
+def init_app(app):
+    app.extensions['market_data'] = None
+    app.cli.add_command(record_fixtures_command)
@@ -1,13 +1,20 @@
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS transactions;
 DROP TABLE IF EXISTS positions;
+DROP TABLE IF EXISTS price_history;
+DROP TABLE IF EXISTS price_coverage;
+DROP TABLE IF EXISTS symbol_info;
+DROP TABLE IF EXISTS lot_snapshots;
+DROP TABLE IF EXISTS lots;
 
 CREATE TABLE user (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   username TEXT UNIQUE NOT NULL,
   password TEXT NOT NULL,
   role TEXT,
-  last_login TIMESTAMP
+  last_login TIMESTAMP,
+  tran_version INTEGER NOT NULL DEFAULT 0,
+  lots_version TEXT
 );
 
 CREATE TABLE transactions (
@@ -18,9 +25,14 @@ CREATE TABLE transactions (
   quantity REAL NOT NULL,
   share_price REAL NOT NULL,
   tran_type TEXT NOT NULL,
+  content_hash TEXT,
   FOREIGN KEY (user_id) REFERENCES user (id)
 );
 
+CREATE INDEX transactions_content_hash ON transactions (user_id, content_hash);
+CREATE INDEX transactions_user_date ON transactions (user_id, tran_date);
+CREATE INDEX transactions_user_symbol ON transactions (user_id, symbol);
+
 CREATE TABLE positions (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   user_id INTEGER NOT NULL,
@@ -32,3 +44,44 @@ CREATE TABLE positions (
   FOREIGN KEY (user_id) REFERENCES user (id)
 );
 
+CREATE UNIQUE INDEX positions_user_symbol ON positions (user_id, symbol);
+
+CREATE TABLE price_history (
+  symbol TEXT NOT NULL,
+  price_date TEXT NOT NULL,
+  close REAL NOT NULL,
+  PRIMARY KEY (symbol, price_date)
+) WITHOUT ROWID;
+
+CREATE TABLE price_coverage (
+  symbol TEXT PRIMARY KEY,
+  start_date TEXT NOT NULL,
+  end_date TEXT NOT NULL
+);
+
+CREATE TABLE symbol_info (
+  symbol TEXT NOT NULL,
+  field_group TEXT NOT NULL,
+  data TEXT NOT NULL,
+  updated TIMESTAMP NOT NULL,
+  PRIMARY KEY (symbol, field_group)
+);
+
+CREATE TABLE lot_snapshots (
+  user_id INTEGER NOT NULL,
+  symbol TEXT NOT NULL,
+  seq INTEGER NOT NULL,
+  tran_date TEXT NOT NULL,
+  state BLOB NOT NULL,
+  splits_digest TEXT,
+  PRIMARY KEY (user_id, symbol, seq),
+  FOREIGN KEY (user_id) REFERENCES user (id)
+);
+
+CREATE TABLE lots (
+  user_id INTEGER NOT NULL,
+  symbol TEXT NOT NULL,
+  state BLOB NOT NULL,
+  PRIMARY KEY (user_id, symbol),
+  FOREIGN KEY (user_id) REFERENCES user (id)
+);
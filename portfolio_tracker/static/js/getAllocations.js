@@ -11,12 +11,15 @@ function getAllocations() {
             throw new Error(`HTTP error! status: ${resp.status}`);
             }
         })
-        .then(data => {
-            document.getElementById('allocations-graph').innerText = '';
-            if (!data) return;
-            var config = {displayModeBar: false};
-            Plotly.setPlotConfig(config);
-            Plotly.newPlot('allocations-graph', data, {}, config);
-        })
+        .then(renderAllocations)
+    };
+
+function renderAllocations(data) {
+    // render the allocations graph, or clear it if there is no data
+    document.getElementById('allocations-graph').innerText = '';
+    if (!data) return;
+    var config = {displayModeBar: false};
+    Plotly.setPlotConfig(config);
+    Plotly.newPlot('allocations-graph', data, {}, config);
     };
     document.addEventListener('DOMContentLoaded', getAllocations);
\ No newline at end of file
@@ -0,0 +1,6 @@
+function renderAttribution(htmlContent) {
+    const targetElement = document.getElementById('attribution-table');
+    if (targetElement) {
+        targetElement.innerHTML = htmlContent; 
+    }
+};
@@ -0,0 +1,25 @@
+function getDashboard() {
+// Function to get every section of the dashboard with one fetch and render them
+    setTimeout(() => {
+        Url = window.dashboardUrl+'?tf='+window.tf+'&adj='+window.adj+'&comp='+window.compare+'&disp='+window.disp+'&excluded='+window.excluded.join(',')
+        fetch(Url)
+        .then(response => {
+                if (!response.ok) {
+                    throw new Error('Network response was not ok');
+                }
+                return response.json();
+            })
+        .then(data => {
+            renderHistory(data.history);
+            renderAllocations(data.allocations);
+            renderPositionsTable(data.positions);
+            renderMetricsTable(data.metrics);
+            renderRollingBeta(data.rolling_beta);
+            renderAttribution(data.attribution);
+            renderSummary(data.summary);
+        })
+        .catch(error => {
+            console.error('Error fetching dashboard:', error);
+        });
+    }, 10);
+};
@@ -12,14 +12,17 @@ function getHistory() {
             throw new Error(`HTTP error! status: ${resp.status}`);
             }
         })
-        .then(data => {
-            document.getElementById('history-graph').innerText = '';
-            if (!data) return;
-            var config = {displayModeBar: false};
-            Plotly.setPlotConfig(config);
-            Plotly.newPlot('history-graph', data, {}, config);
-        })
+        .then(renderHistory)
     }, 10);
 
     };
+
+function renderHistory(data) {
+    // render the history graph, or clear it if there is no data
+    document.getElementById('history-graph').innerText = '';
+    if (!data) return;
+    var config = {displayModeBar: false};
+    Plotly.setPlotConfig(config);
+    Plotly.newPlot('history-graph', data, {}, config);
+    };
     // document.addEventListener('DOMContentLoaded', getHistory);
\ No newline at end of file
@@ -9,15 +9,16 @@ setTimeout(() => {
             }
             return response.text(); 
         })
-    .then(htmlContent => {
-        const targetElement = document.getElementById('metrics-table');
-        if (targetElement) {
-            targetElement.innerHTML = htmlContent; 
-        }
-    })
+    .then(renderMetricsTable)
     .catch(error => {
         console.error('Error fetching HTML:', error);
     });
     }, 10);
 };
 
+function renderMetricsTable(htmlContent) {
+    const targetElement = document.getElementById('metrics-table');
+    if (targetElement) {
+        targetElement.innerHTML = htmlContent; 
+    }
+};
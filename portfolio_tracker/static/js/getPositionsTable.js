@@ -9,12 +9,7 @@ function getPositionsTable() {
                 }
                 return response.text(); 
             })
-        .then(htmlContent => {
-            const targetElement = document.getElementById('positions-table');
-            if (targetElement) {
-                targetElement.innerHTML = htmlContent; 
-            }
-        })
+        .then(renderPositionsTable)
         .catch(error => {
             console.error('Error fetching HTML:', error);
         });
@@ -22,3 +17,9 @@ function getPositionsTable() {
 
 };
 
+function renderPositionsTable(htmlContent) {
+    const targetElement = document.getElementById('positions-table');
+    if (targetElement) {
+        targetElement.innerHTML = htmlContent; 
+    }
+};
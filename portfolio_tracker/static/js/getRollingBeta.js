@@ -0,0 +1,27 @@
+function getRollingBeta() {
+    // function to get rolling beta graph with fetch and render with Plotly
+    setTimeout(() => {
+        Url = window.rollingBetaUrl+'?comp='+window.compare+'&excluded='+window.excluded.join(',')
+        fetch(Url)
+        .then(resp => {
+            if (resp.status == 204) {
+            document.getElementById('rolling-beta-graph').innerText = '';
+            } else if (resp.ok) {
+            return resp.json();
+            } else {
+            throw new Error(`HTTP error! status: ${resp.status}`);
+            }
+        })
+        .then(renderRollingBeta)
+    }, 10);
+
+    };
+
+function renderRollingBeta(data) {
+    // render the rolling beta graph, or clear it if there is no data
+    document.getElementById('rolling-beta-graph').innerText = '';
+    if (!data) return;
+    var config = {displayModeBar: false};
+    Plotly.setPlotConfig(config);
+    Plotly.newPlot('rolling-beta-graph', data, {}, config);
+    };
@@ -8,8 +8,13 @@ function getSummary() {
             }
             return response.text(); 
         })
-    .then(data => {
-        const parsedData = JSON.parse(data);
+    .then(data => renderSummary(JSON.parse(data)))
+    .catch(error => {
+        console.error('Error fetching HTML:', error);
+    });
+};
+
+function renderSummary(parsedData) {
         const currentElement = document.getElementById('current-value');
         if (currentElement) {
             currentElement.innerText = parsedData.curr_value_str; 
@@ -24,8 +29,4 @@ function getSummary() {
             totalElement.innerText = parsedData.tot_str;
             totalElement.className = parsedData.tot_col;
         }
-    })
-    .catch(error => {
-        console.error('Error fetching HTML:', error);
-    });
 };
\ No newline at end of file
@@ -3,11 +3,7 @@ document.addEventListener("DOMContentLoaded", function() {
 
     window.disp = "sector";
     window.excluded = [];
-    getHistory();
-    getAllocations();
-    getPositionsTable();
-    getMetricsTable();
-    getSummary();
+    getDashboard();
 
     const btn1mo = document.getElementById('btn-1mo');
     const btn3mo = document.getElementById('btn-3mo');
@@ -39,11 +35,7 @@ document.addEventListener("DOMContentLoaded", function() {
                     selectnone.checked = false;
                 }
             
-            getPositionsTable();
-            getHistory();
-            getAllocations();
-            getMetricsTable();
-            getSummary();
+            getDashboard();
         });
     });
 
@@ -54,11 +46,7 @@ document.addEventListener("DOMContentLoaded", function() {
         });
         selectnone.checked = false;
         window.excluded = [];
-        getPositionsTable();
-        getHistory();
-        getAllocations();
-        getMetricsTable();
-        getSummary();
+        getDashboard();
     });
 
     // Select none checkboxes
@@ -73,11 +61,7 @@ document.addEventListener("DOMContentLoaded", function() {
             selectnone.checked = true;
         }, 10);
         
-        getPositionsTable();
-        getHistory();
-        getAllocations();
-        getMetricsTable();
-        getSummary();
+        getDashboard();
     });
 
     // History Time-frame buttons
@@ -127,6 +111,7 @@ document.addEventListener("DOMContentLoaded", function() {
         btncompare.classList.add('btn-outline-primary');
         getHistory();
         getMetricsTable();
+        getRollingBeta();
     });
     btnsp.addEventListener('click', function() {
         window.compare = "sp";
@@ -138,6 +123,7 @@ document.addEventListener("DOMContentLoaded", function() {
         btncompare.classList.add('btn-primary');
         getHistory();
         getMetricsTable();
+        getRollingBeta();
     });
     btndji.addEventListener('click', function() {
         window.compare = "dji";
@@ -149,6 +135,7 @@ document.addEventListener("DOMContentLoaded", function() {
         btncompare.classList.add('btn-primary');
         getHistory();
         getMetricsTable();
+        getRollingBeta();
     });
     btnnasdaq.addEventListener('click', function() {
         window.compare = "nasdaq";
@@ -160,6 +147,7 @@ document.addEventListener("DOMContentLoaded", function() {
         btncompare.classList.add('btn-primary');
         getHistory();
         getMetricsTable();
+        getRollingBeta();
     });
 
     // Sector/asset buttons
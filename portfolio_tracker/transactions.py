@@ -3,10 +3,11 @@ from portfolio_tracker.auth import login_required
 from portfolio_tracker.db import get_db
 from portfolio_tracker import cache
 from portfolio_tracker.controller import controller
+from portfolio_tracker.uploads import drop_known, read_upload
 import pandas as pd
 import yfinance as yf
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, url_for, Response, jsonify
+    Blueprint, current_app, flash, g, redirect, render_template, request, url_for, Response, jsonify
 )
 
 bp = Blueprint('transactions', __name__, url_prefix='/transactions')
@@ -111,12 +112,6 @@ def upload():
     '''Upload CSV file of transactions
     '''
     if request.method == 'POST':
-        try:
-            df = pd.read_csv(request.files.get('formFile'))
-        except:
-            flash('Unable to parse file')
-            return render_template('transactions/upload.html')
-
         date_col = request.form.get('tran_date_select')
         symb_col = request.form.get('symbol_select')
         q_col = request.form.get('quantity_select')
@@ -125,47 +120,33 @@ def upload():
         if date_col == 'Select column' or symb_col == 'Select column' or q_col == 'Select column' or price_col == 'Select column':
             data = {"message": "Transaction Saved."}
             return jsonify(data), 400
-        
-        errors = []
-        try:
-            df[date_col] = df[date_col].apply(lambda x: pd.Timestamp(x).strftime('%Y-%m-%d'))
-        except:
-            errors.append(f'Unable to convert column {date_col} to date')
-        try:
-            df[symb_col] = df[symb_col].astype(str)
-        except:
-            errors.append(f'Unable to convert column {symb_col} to string')
-        try:
-            df[q_col] = df[q_col].astype(float)
-            if len(df[df[q_col]<0]) > 0:
-                errors.append('Quantity must be positive.')
-        except:
-            errors.append(f'Unable to convert column {q_col} to numeric')
-        try:
-            if df[price_col].dtype == object:
-                df[price_col] = df[price_col].apply(lambda x: x.replace('$','').replace(',','').replace('(','').replace(')',''))
-            df[price_col] = df[price_col].astype(float)
-            if len(df[df[price_col]<0]) > 0:
-                errors.append('Price must be positive.')
-        except:
-            errors.append(f'Unable to convert column {price_col} to numeric')
+
+        columns = {'tran_date':date_col,'symbol':symb_col,'quantity':q_col,'share_price':price_col,'tran_type':type_col}
         try:
-            df[type_col] = df[type_col].astype(str).apply(lambda x: x.upper())
-            if len(df[(df[type_col]!='BUY')&(df[type_col]!='SELL')&(df[type_col]!='FEE')]) > 0:
-                errors.append('Transaction type must be BUY, SELL, or FEE')
+            df, errors = read_upload(request.files.get('formFile'), columns, current_app.config['UPLOAD_CHUNK_SIZE'])
         except:
-            errors.append(f'Unable to convert column {type_col} to numeric')
+            flash('Unable to parse file')
+            return render_template('transactions/upload.html')
         if len(errors) > 0:
             data = {"message": '\n'.join(errors)}
             return jsonify(data), 400
-        
-        df = df.rename(columns={date_col:'tran_date',symb_col:'symbol',q_col:'quantity',price_col:'share_price',type_col:'tran_type'})
-        errors = controller.check_transaction('upload', df)
+        if len(df) == 0:
+            data = {"message": "No transactions found."}
+            return jsonify(data), 400
+
+        # skip transactions already saved from an earlier upload
+        new = drop_known(g.user['id'], df)
+        skipped = len(df) - len(new)
+        if len(new) == 0:
+            data = {"message": f'No new transactions, {skipped} already uploaded'}
+            return jsonify(data), 200
+
+        errors = controller.check_transaction('upload', new)
         if len(errors) > 0:
             data = {"message": '\n'.join(errors)}
             return jsonify(data), 400
 
-        data = {"message": f'{len(df)} Transactions Uploaded'}
+        data = {"message": f'{len(new)} Transactions Uploaded' + (f', {skipped} already uploaded' if skipped else '')}
         return jsonify(data), 200
         
     return render_template('transactions/upload.html')
@@ -0,0 +1,104 @@
+import pandas as pd
+from portfolio_tracker.db import content_hashes, get_db, placeholders
+
+FIELDS = ['tran_date','symbol','quantity','share_price','tran_type']
+TRAN_TYPES = ['BUY','SELL','FEE']
+MAX_ROW_ERRORS = 20
+QUERY_BATCH = 500
+
+def normalize_chunk(chunk):
+    '''Convert a chunk of uploaded text columns to transactions. Returns the normalized
+    transactions and (line, message) errors for the rows that failed validation
+    '''
+    dates = pd.to_datetime(chunk['tran_date'], format='mixed', errors='coerce')
+    symbol = chunk['symbol'].str.strip()
+    quantity = pd.to_numeric(chunk['quantity'], errors='coerce').astype(float)
+    share_price = pd.to_numeric(chunk['share_price'].str.replace(r'[$,()]', '', regex=True), errors='coerce')
+    tran_type = chunk['tran_type'].str.upper()
+
+    checks = [
+        (dates.isna(), 'invalid date'),
+        (symbol.isna() | (symbol == ''), 'symbol is required'),
+        (quantity.isna(), 'invalid quantity'),
+        (quantity < 0, 'quantity must be positive'),
+        (share_price.isna(), 'invalid share price'),
+        (share_price < 0, 'share price must be positive'),
+        (~tran_type.isin(TRAN_TYPES), 'transaction type must be BUY, SELL, or FEE'),
+    ]
+    errors = []
+    for mask, message in checks:
+        errors.extend((line, message) for line in chunk.index[mask.to_numpy()] + 2) # header is line 1
+
+    transactions = pd.DataFrame({
+        'tran_date': dates.dt.strftime('%Y-%m-%d'),
+        'symbol': symbol,
+        'quantity': quantity,
+        'share_price': share_price,
+        'tran_type': tran_type,
+    })
+    return transactions, errors
+
+def read_chunks(file, columns, chunksize):
+    '''Read the selected columns of a CSV file in chunks of chunksize rows. columns maps each of
+    FIELDS to a column in the file. Yields the normalized transactions and errors of each chunk
+    '''
+    reader = pd.read_csv(file, usecols=list(set(columns.values())), dtype=str, chunksize=chunksize)
+    for chunk in reader:
+        yield normalize_chunk(pd.DataFrame({field: chunk[columns[field]] for field in FIELDS}))
+
+def format_errors(errors, error_count):
+    '''Format the first (line, message) row errors, noting how many more there are
+    '''
+    messages = [f'Line {line}: {message}' for line, message in errors]
+    if error_count > len(messages):
+        messages.append(f'{error_count - len(messages)} more errors')
+    return messages
+
+def read_upload(file, columns, chunksize):
+    '''Read an uploaded CSV file in chunks of chunksize rows, validating each chunk as it is read.
+    Returns the transactions and a list of errors, reporting the first MAX_ROW_ERRORS failed rows
+    '''
+    chunks = []
+    errors = []
+    error_count = 0
+    for transactions, chunk_errors in read_chunks(file, columns, chunksize):
+        error_count += len(chunk_errors)
+        if error_count > 0: # no need to keep rows once the upload has failed
+            errors = sorted(errors + chunk_errors)[:MAX_ROW_ERRORS]
+            chunks = []
+            continue
+        chunks.append(transactions)
+
+    if error_count > 0:
+        return None, format_errors(errors, error_count)
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=FIELDS), []
+    return pd.concat(chunks, ignore_index=True), []
+
+def drop_known(user_id, transactions, seen=None, before_id=None):
+    '''Drop uploaded transactions that are already saved for the user, matching them by content hash.
+    Identical rows are counted, so a file with the same transaction twice keeps the copy not yet saved.
+    When a file is deduplicated chunk by chunk, seen carries the count of each saved hash read from
+    earlier chunks and before_id excludes the rows inserted from them
+    '''
+    hashes = pd.Series(content_hashes(user_id, transactions), index=transactions.index)
+    db = get_db()
+    unique = hashes.unique().tolist()
+    known = {}
+    for i in range(0, len(unique), QUERY_BATCH):
+        batch = unique[i:i+QUERY_BATCH]
+        if before_id is None:
+            rows = db.execute(f'''SELECT content_hash, COUNT(*) FROM transactions
+                WHERE user_id = ? AND content_hash IN ({placeholders(batch)}) GROUP BY content_hash''', [user_id] + batch).fetchall()
+        else:
+            rows = db.execute(f'''SELECT content_hash, COUNT(*) FROM transactions
+                WHERE user_id = ? AND content_hash IN ({placeholders(batch)}) AND id <= ? GROUP BY content_hash''',
+                [user_id] + batch + [before_id]).fetchall()
+        known.update((r[0], r[1]) for r in rows)
+    occurrence = hashes.groupby(hashes).cumcount()
+    if seen is not None:
+        occurrence += hashes.map(seen).fillna(0).astype(int)
+        for h, count in hashes[hashes.isin(known.keys())].value_counts().items():
+            seen[h] = seen.get(h, 0) + count
+    keep = occurrence >= hashes.map(known).fillna(0)
+    return transactions[keep].reset_index(drop=True)
@@ -0,0 +1,157 @@
+import uuid
+import msgspec
+import numpy as np
+import pandas as pd
+from cachelib.file import FileSystemCache
+from flask import current_app, g, has_request_context, session
+
+NAMES = ['info','positions','lot_splits','transactions']
+VERSIONS = {'info': 'price_version', 'positions': 'portfolio_version', 'lot_splits': 'portfolio_version', 'transactions': 'portfolio_version'} # bumped when each is set
+
+def get_store():
+    '''Get the per-user data cache, creating it on first use
+    '''
+    if current_app.extensions.get('user_data') is None:
+        current_app.extensions['user_data'] = FileSystemCache(
+            current_app.config['USER_DATA_DIR'], threshold=current_app.config['USER_DATA_THRESHOLD'],
+            default_timeout=0) # kept until replaced, discarded or pruned
+    return current_app.extensions['user_data']
+
+def _state():
+    '''Get where the data key and versions are kept: the session in a request, otherwise g, so commands
+    can work on a user's data under a data key of their own
+    '''
+    if has_request_context():
+        return session
+    return g.setdefault('user_data_state', {})
+
+def _key(name):
+    return f"{g.user['id']}:{_state().get('data_key')}:{name}"
+
+def _enc_hook(obj):
+    if isinstance(obj, np.generic): # numpy scalars from market data
+        return obj.item()
+    raise NotImplementedError(f'Cannot encode {type(obj)}')
+
+def encode_frame(df):
+    '''Encode a frame column by column, numeric columns as raw arrays
+    '''
+    columns = {}
+    for name, column in df.items():
+        if column.dtype.kind in 'biuf':
+            columns[name] = [column.dtype.str, column.to_numpy().tobytes()]
+        else:
+            columns[name] = ['O', column.tolist()]
+    return msgspec.msgpack.encode({'index': df.index.to_numpy(dtype='int64').tobytes(), 'columns': columns}, enc_hook=_enc_hook)
+
+def decode_frame(data):
+    '''Decode a frame encoded by encode_frame
+    '''
+    data = msgspec.msgpack.decode(data)
+    columns = {}
+    for name, (dtype, values) in data['columns'].items():
+        columns[name] = np.frombuffer(values, dtype=dtype).copy() if dtype != 'O' else values
+    return pd.DataFrame(columns, index=np.frombuffer(data['index'], dtype='int64').copy())
+
+CODECS = {
+    'info': (lambda info: msgspec.msgpack.encode(info, enc_hook=_enc_hook), msgspec.msgpack.decode),
+    'positions': (msgspec.msgpack.encode, msgspec.msgpack.decode),
+    'lot_splits': (msgspec.msgpack.encode, msgspec.msgpack.decode),
+    'transactions': (encode_frame, decode_frame),
+}
+
+def _reload():
+    '''Rebuild the logged in user's data after entries were pruned from the store, at most once per request
+    '''
+    from portfolio_tracker.controller import controller
+    g.user_data_loading = True
+    errors, pending = getattr(controller, 'errors', []), getattr(controller, 'pending', None)
+    controller.update_info([])
+    controller.load_user_data()
+    controller.errors, controller.pending = errors, pending
+
+def _get(name):
+    loaded = g.setdefault('user_data', {})
+    if name not in loaded:
+        data = get_store().get(_key(name)) if _state().get('data_key') else None
+        if data is None and _state().get('data_key') and not g.get('user_data_loading'):
+            # every entry is set when the data is loaded, so a missing one was pruned
+            _reload()
+            return _get(name)
+        loaded[name] = CODECS[name][1](data) if data else None
+    return loaded[name]
+
+def _set(name, value):
+    g.setdefault('user_data', {})[name] = value
+    bump_version(VERSIONS[name])
+    get_store().set(_key(name), b'' if value is None else CODECS[name][0](value))
+
+def bump_version(name):
+    '''Increment portfolio_version or price_version, marking results derived from them as stale
+    '''
+    state = _state()
+    state[name] = state.get(name, 0)+1
+
+def version_key():
+    '''Get a key identifying the logged in user's current data
+    '''
+    state = _state()
+    return f"{g.user['id']}:{state.get('data_key')}:{state.get('portfolio_version', 0)}:{state.get('price_version', 0)}"
+
+def new_data_key():
+    '''Start a new empty set of cached data for the logged in user, discarding the previous one
+    '''
+    discard_user_data()
+    _state()['data_key'] = uuid.uuid4().hex
+    g.user_data = {}
+    g.user_data_loading = True # entries are missing until the caller loads them
+
+def discard_user_data():
+    '''Delete the logged in user's cached data
+    '''
+    if _state().get('data_key'):
+        get_store().delete_many(*[_key(name) for name in NAMES])
+    g.user_data = {}
+
+def get_info():
+    '''Get the cached symbol -> info dict, or None
+    '''
+    return _get('info')
+
+def set_info(info):
+    _set('info', info)
+
+def get_positions():
+    '''Get the cached symbol -> serialized lots dict, or None
+    '''
+    return _get('positions')
+
+def set_positions(positions):
+    _set('positions', positions)
+
+def get_lot_splits():
+    '''Get the cached symbol -> digest of the splits its lots were adjusted with, or None
+    '''
+    return _get('lot_splits')
+
+def set_lot_splits(lot_splits):
+    _set('lot_splits', lot_splits)
+
+def get_transactions():
+    '''Get a copy of the cached split adjusted transactions, or None
+    '''
+    transactions = _get('transactions')
+    return None if transactions is None else transactions.copy()
+
+def set_transactions(transactions):
+    _set('transactions', transactions)
+
+def inject_symbols():
+    '''Make the logged in user's symbols available to templates
+    '''
+    info = get_info() if g.get('user') else None
+    return {'symbols': list(info or {})}
+
+def init_app(app):
+    app.extensions['user_data'] = None
+    app.context_processor(inject_symbols)